@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""Benchmark cwldep install/check/update against local upstreams.
+
+Generates a synthetic dependency tree served by a local HTTP server,
+plus local git repositories and tar.gz archives, then times cwldep runs
+for a series of scenarios.  Every run is a separate process so that
+start-up time is included and peak memory can be measured per run.
+Results are written as JSON, with the peak RSS of each run in
+max_rss_kib; compare warm_install and low_memory_install with a large
+--steps or --workflows to track the memory used on big workflows.
+
+    python benchmarks/bench_cwldep.py --width 3 --depth 3 --output results.json
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import functools
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+except ImportError:  # pragma: no cover
+    ThreadingHTTPServer = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ("cold_install", "warm_install", "check", "update", "low_memory_install")
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map, **{".cwl": "text/plain",
+                                                                     ".yml": "text/plain"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory):
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def write(path, content):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def dependencies_hint(upstreams):
+    lines = ["$namespaces:", "  dep: http://commonwl.org/cwldep#",
+             "hints:", "  dep:Dependencies:", "    dependencies:"]
+    for upstream in upstreams:
+        lines.append("    - upstream: %s" % upstream)
+    return "\n".join(lines) + "\n"
+
+
+def workflow(upstreams, run=None):
+    doc = "cwlVersion: v1.0\nclass: Workflow\n"
+    if upstreams:
+        doc += dependencies_hint(upstreams)
+    doc += "inputs: []\noutputs: []\n"
+    if run:
+        doc += "steps:\n  step:\n    in: []\n    out: []\n    run: %s\n" % run
+    else:
+        doc += "steps: []\n"
+    return doc
+
+
+def top_level(upstreams, steps):
+    """Return the workflow being installed, with `steps` inline tool steps."""
+    doc = workflow(upstreams)
+    if not steps:
+        return doc
+    doc = doc.replace("steps: []\n", "steps:\n")
+    for i in range(steps):
+        doc += ("  step%d:\n    in: []\n    out: []\n"
+                "    run: {class: CommandLineTool, baseCommand: echo, inputs: [], outputs: []}\n" % i)
+    return doc
+
+
+def generate_node(srv, base_url, node, level, opts):
+    """Write the document for one node of the tree and return its URL.
+
+    Each node is a workflow whose step runs a chain of `chain` documents
+    ending in a tool that $imports a hints file, and that depends on
+    `width` nodes of the next level.
+    """
+    children = []
+    if level < opts.depth:
+        for i in range(opts.width):
+            children.append(generate_node(srv, base_url, "%s_%d" % (node, i), level + 1, opts))
+
+    d = os.path.join(srv, "nodes", node)
+    for i in range(opts.chain):
+        write(os.path.join(d, "step%d.cwl" % i), workflow([], "step%d.cwl" % (i + 1)))
+    write(os.path.join(d, "step%d.cwl" % opts.chain),
+          "cwlVersion: v1.0\nclass: CommandLineTool\nbaseCommand: echo\n"
+          "hints:\n  - $import: hints.yml\ninputs: []\noutputs: []\n")
+    write(os.path.join(d, "hints.yml"), "class: ResourceRequirement\ncoresMin: 1\n")
+    write(os.path.join(d, "main.cwl"), workflow(children, "step0.cwl"))
+    return "%s/nodes/%s/main.cwl" % (base_url, node)
+
+
+def generate_archive(path, size):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with tarfile.open(path, "w:gz") as t:
+        data = os.urandom(size)
+        info = tarfile.TarInfo("data/blob.bin")
+        info.size = len(data)
+        t.addfile(info, io.BytesIO(data))
+
+
+def generate_git(path, commits):
+    env = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@example.com",
+               GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@example.com")
+    subprocess.check_call(["git", "init", "--quiet", path])
+    for n in range(commits):
+        write(os.path.join(path, "tool.cwl"), "# revision %d\n" % n)
+        subprocess.check_call(["git", "add", "tool.cwl"], cwd=path, env=env)
+        subprocess.check_call(["git", "commit", "--quiet", "-m", "revision %d" % n], cwd=path, env=env)
+
+
+def generate(tmp, base_url, opts):
+    srv = os.path.join(tmp, "srv")
+    upstreams = [generate_node(srv, base_url, "n%d" % i, 1, opts) for i in range(opts.width)]
+    for i in range(opts.archives):
+        generate_archive(os.path.join(srv, "archives", "a%d.tar.gz" % i), opts.archive_size)
+        upstreams.append("%s/archives/a%d.tar.gz" % (base_url, i))
+    for i in range(opts.git):
+        repo = os.path.join(tmp, "git", "repo%d" % i)
+        generate_git(repo, opts.git_commits)
+        upstreams.append("file://" + repo)
+    return srv, upstreams
+
+
+def run_cwldep(args, cwd, verbose):
+    """Run cwldep in a new process and return (seconds, peak RSS in KiB)."""
+    cmd = [sys.executable, "-c", "import sys, cwldep; sys.exit(cwldep.main(sys.argv[1:]))"] + args
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+    start = time.time()
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=None if verbose else subprocess.DEVNULL,
+                            stderr=None if verbose else subprocess.DEVNULL)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.time() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError("cwldep %s failed with status %d" % (" ".join(args), proc.returncode))
+    maxrss = rusage.ru_maxrss
+    if sys.platform == "darwin":
+        maxrss //= 1024
+    return elapsed, maxrss
+
+
+def workflow_names(opts):
+    return ["main.cwl"] + ["main%d.cwl" % i for i in range(1, opts.workflows)]
+
+
+def measure(scenario, opts, work, cache):
+    cmd = ["update" if scenario == "update" else ("check" if scenario == "check" else "install")
+           ] + workflow_names(opts) + ["--cache-dir", cache] + opts.cwldep_args
+    if scenario == "low_memory_install":
+        cmd.append("--low-memory")
+    timings = []
+    peak = 0
+    for _ in range(opts.repeat):
+        if scenario == "cold_install":
+            for name in os.listdir(work):
+                if name not in workflow_names(opts):
+                    p = os.path.join(work, name)
+                    shutil.rmtree(p) if os.path.isdir(p) else os.remove(p)
+            shutil.rmtree(cache, ignore_errors=True)
+        elapsed, maxrss = run_cwldep(cmd, work, opts.verbose)
+        timings.append(elapsed)
+        peak = max(peak, maxrss)
+    timings.sort()
+    return {
+        "scenario": scenario,
+        "command": cmd,
+        "seconds": timings,
+        "median_seconds": timings[len(timings) // 2],
+        "min_seconds": timings[0],
+        "max_rss_kib": peak
+    }
+
+
+def versions():
+    result = {"python": platform.python_version(), "platform": platform.platform()}
+    try:
+        from importlib.metadata import version
+        for dist in ("cwltool", "schema-salad", "requests"):
+            result[dist] = version(dist)
+    except Exception:  # pragma: no cover
+        pass
+    return result
+
+
+def dict_opts(opts, **overrides):
+    copy = argparse.Namespace(**vars(opts))
+    for k, v in overrides.items():
+        setattr(copy, k, v)
+    return copy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cwldep against local upstreams")
+    parser.add_argument("--width", type=int, default=3, help="Dependencies declared by each document")
+    parser.add_argument("--depth", type=int, default=2, help="Levels of nested dep:Dependencies")
+    parser.add_argument("--chain", type=int, default=2, help="Length of each run/$import chain")
+    parser.add_argument("--archives", type=int, default=1, help="Number of tar.gz upstreams")
+    parser.add_argument("--archive-size", type=int, default=2**20, help="Bytes of data in each archive")
+    parser.add_argument("--git", type=int, default=1, help="Number of git upstreams")
+    parser.add_argument("--git-commits", type=int, default=5, help="Commits in each git upstream")
+    parser.add_argument("--steps", type=int, default=0,
+                        help="Inline steps in the installed workflow, to measure peak memory on large documents")
+    parser.add_argument("--workflows", type=int, default=1,
+                        help="Copies of the installed workflow resolved together in each run")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="Scenarios to run (default: all)")
+    parser.add_argument("--cwldep-args", type=str, default="",
+                        help="Extra arguments for cwldep, e.g. '--jobs 8'")
+    parser.add_argument("--output", type=str, default=None, help="Write JSON results here")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated files")
+    parser.add_argument("--verbose", action="store_true", help="Show cwldep output")
+    opts = parser.parse_args(argv)
+    opts.cwldep_args = opts.cwldep_args.split()
+
+    tmp = tempfile.mkdtemp(prefix="cwldep-bench-")
+    server = None
+    try:
+        srv = os.path.join(tmp, "srv")
+        os.makedirs(srv)
+        server = serve(srv)
+        base_url = "http://127.0.0.1:%d" % server.server_address[1]
+        _, upstreams = generate(tmp, base_url, opts)
+
+        work = os.path.join(tmp, "work")
+        for name in workflow_names(opts):
+            write(os.path.join(work, name), top_level(upstreams, opts.steps))
+        cache = os.path.join(tmp, "cache")
+
+        results = []
+        # Later scenarios run against what cold_install left behind.
+        for scenario in opts.scenario or SCENARIOS:
+            locked = any(os.path.exists(os.path.join(work, "main.cwl.dep.lock" + s)) for s in ("", ".d"))
+            if scenario != "cold_install" and not locked:
+                measure("cold_install", dict_opts(opts, repeat=1), work, cache)
+            results.append(measure(scenario, opts, work, cache))
+
+        report = {
+            "parameters": {k: v for k, v in vars(opts).items() if k not in ("output", "keep", "verbose")},
+            "environment": versions(),
+            "results": results
+        }
+        out = json.dumps(report, indent=4, sort_keys=True)
+        if opts.output:
+            with open(opts.output, "w") as f:
+                f.write(out + "\n")
+        else:
+            print(out)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if opts.keep:
+            print("Generated files kept in %s" % tmp, file=sys.stderr)
+        else:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,528 @@
 from __future__ import print_function
-import cwltool.factory
-import cwltool.context
-import subprocess
 import json
 import hashlib
+import io
 import os
 from six.moves import urllib
-import schema_salad.ref_resolver
-from cwltool.process import scandeps, get_schema
-from cwltool.load_tool import load_tool
-from cwltool.utils import visit_class
-from cwltool.command_line_tool import CommandLineTool
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
-import sys
-from cwltool.docker import DockerCommandLineJob
-import tempfile
-import shellescape
+import posixpath
 import shutil
-import tarfile
-import zipfile
 from dateutil.tz import tzlocal
 from datetime import datetime
 import re
 import argparse
-import ruamel.yaml
-from schema_salad.sourceline import cmap
+import contextlib
+import copy
+import fnmatch
+import glob
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from . import git, trace
+from .bundle import Bundle, BundleWriter
+from .cache import INSTALL_STRATEGIES, ObjectCache, default_cache_dir, install_file, parse_size
+from .clean import PathIndex, disk_usage, installed_symlinks, outermost, remove_paths
+from .lockfile import open_lock, write_atomic
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# cwltool, schema_salad and ruamel.yaml take a noticeable part of a second
+# to import and are only needed by commands that read CWL documents, so
+# they are imported in the functions that use them.
 
 logging.basicConfig(level=logging.INFO)
 
 CWLDEP_URL = "http://commonwl.org/cwldep#"
 CWLDEP_DEPENDENCIES_URL = "{}Dependencies".format(CWLDEP_URL)
 
+HASH_ALGORITHMS = ("sha1", "sha256", "blake2b")
+DEFAULT_HASH_ALGORITHM = "sha1"
+FAST_HASH = "xxh3"
 
-def download(tgt, url, version, locks, verified, check_only):
+_schema_lock = threading.Lock()
+_schema_contexts = {}
+
+
+class LockMismatch(Exception):
+    """A frozen install found content that differs from the lock file."""
+
+
+class FetchPool(object):
+    """Run fetch tasks on a bounded pool of worker threads.
+
+    Tasks may submit further tasks; wait() returns once all of them,
+    including those submitted while waiting, have finished, or raises
+    the error of the first task that failed.  With a single job, tasks
+    run immediately in the calling thread.
+    """
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(jobs) if jobs > 1 else None
+
+    def submit(self, fn, *args):
+        if self._executor is None:
+            fn(*args)
+            return
+        f = self._executor.submit(fn, *args)
+        with self._lock:
+            self._pending.add(f)
+        f.add_done_callback(self._done)
+
+    def _done(self, f):
+        # Tasks that succeeded are forgotten at once, so a run submitting
+        # one task per file does not keep them all until wait().
+        if not f.cancelled() and f.exception() is None:
+            with self._lock:
+                self._pending.discard(f)
+
+    def wait(self):
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            if not pending:
+                return
+            done, not_done = wait_futures(pending, return_when=FIRST_EXCEPTION)
+            for f in done:
+                f.result()
+            with self._lock:
+                self._pending.update(not_done)
+
+    def shutdown(self):
+        # Tasks still queued after a failure are not started.
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+
+class TimeoutAdapter(HTTPAdapter):
+    """An HTTP adapter that gives requests made without a timeout one."""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super(TimeoutAdapter, self).__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super(TimeoutAdapter, self).send(request, timeout=self.timeout if timeout is None else timeout,
+                                                **kwargs)
+
+
+def make_session(pool_size=10, retries=3, backoff=0.5, timeout=60):
+    """Create an HTTP session that keeps connections alive and retries.
+
+    Each host gets up to pool_size pooled connections.  Connection
+    errors and 5xx responses are retried with exponential backoff.
+    Requests made without a timeout, such as those loading CWL
+    documents, get timeout as theirs.
+    """
+    session = requests.Session()
+    adapter = TimeoutAdapter(timeout, pool_connections=pool_size, pool_maxsize=pool_size,
+                             max_retries=Retry(total=retries, backoff_factor=backoff,
+                                               status_forcelist=(500, 502, 503, 504)))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class DepContext(object):
+    """State shared by every dependency resolved in one cwldep run.
+
+    When a run resolves several workflows, each gets its own context from
+    for_root() with its own lock, stat index and graph cache.
+    """
+
+    def __init__(self, jobs=1, cache=None, session=None, timeout=60,
+                 stat_index=None, paranoid=False, graph=None, keep_archives=True,
+                 git_depth=None, git_filter=None, git_cache=None, tracer=None,
+                 hash_algorithm=DEFAULT_HASH_ALGORITHM, frozen=False, bundle=None, lock_file=None,
+                 install_strategy="copy", dry_run=False):
+        self.lock = threading.RLock()
+        self.pool = FetchPool(jobs)
+        self.cache = cache
+        self.session = session if session is not None else make_session(max(10, jobs), timeout=timeout)
+        self.timeout = timeout
+        self.stat_index = stat_index
+        self.paranoid = paranoid
+        self.graph = graph
+        self.keep_archives = keep_archives
+        self.git_depth = git_depth
+        self.git_filter = git_filter
+        self.git_cache = git_cache
+        self.tracer = tracer if tracer is not None else trace.NULL
+        self.hash_algorithm = hash_algorithm
+        self.frozen = frozen
+        self.bundle = bundle
+        self.resolved = DependencyGraph()
+        self.lock_file = lock_file
+        self.install_strategy = install_strategy
+        self.dry_run = dry_run
+        self.batch = Batch()
+
+    def for_root(self, **state):
+        """Return a context for one more workflow of this run.
+
+        It shares the pool, session, caches and batch of this context,
+        with a dependency graph of its own and state replacing the
+        workflow's stat_index, graph, lock_file or hash_algorithm.
+        """
+        root = copy.copy(self)
+        root.lock = threading.RLock()
+        root.resolved = DependencyGraph()
+        for name, value in state.items():
+            setattr(root, name, value)
+        return root
+
+    def record(self, verified, rel, entry):
+        with self.lock:
+            verified[rel] = entry
+        self.batch.record(rel, entry)
+        if self.lock_file is not None:
+            self.lock_file.record(rel, entry)
+
+    def algorithms(self, rel, locks):
+        """Digests to compute for rel: the lock file's, the locked entry's
+        (to compare against) and the stat index's fast hash."""
+        algorithms = [self.hash_algorithm]
+        if rel in locks and locks[rel].get("checksum"):
+            algorithms.append(checksum_algorithm(locks[rel]["checksum"]))
+        if xxhash is not None and self.stat_index is not None:
+            algorithms.append(FAST_HASH)
+        return algorithms
+
+
+class StatIndex(object):
+    """Checksums of installed files keyed by (size, mtime_ns, inode).
+
+    A file whose stat fingerprint is unchanged since its checksum was
+    recorded is not hashed again.  Files modified within a couple of
+    seconds of being recorded are never trusted, since a coarse mtime
+    could hide a later write.  When xxhash is installed the entry also
+    keeps a fast non-cryptographic hash, so a file that was only touched
+    or copied is confirmed without recomputing the checksum.
+    """
+
+    RACY_NS = 2 * 10**9
+
+    class Entry(object):
+        """The recorded checksum and stat fingerprint of one file."""
+
+        __slots__ = ("stat", "recorded", "checksum", "fast")
+
+        def __init__(self, stat, recorded, checksum, fast=None):
+            self.stat = stat
+            self.recorded = recorded
+            self.checksum = checksum
+            self.fast = fast
+
+        @classmethod
+        def from_json(cls, obj):
+            if "stat" not in obj:
+                return obj
+            return cls(tuple(obj["stat"]), obj["recorded"], obj["checksum"], obj.get("fast"))
+
+        def to_json(self):
+            obj = {"stat": list(self.stat), "recorded": self.recorded, "checksum": self.checksum}
+            if self.fast:
+                obj["fast"] = self.fast
+            return obj
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f, object_hook=self.Entry.from_json)
+
+    @staticmethod
+    def fingerprint(st):
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def lookup(self, tgt, rel):
+        e = self.entries.get(rel)
+        if e is None:
+            return None
+        try:
+            st = os.stat(tgt)
+        except OSError:
+            return None
+        if self.fingerprint(st) == e.stat and e.recorded - st.st_mtime_ns >= self.RACY_NS:
+            return e.checksum
+        if xxhash is not None and e.fast and st.st_size == e.stat[0]:
+            if file_digests(tgt, [FAST_HASH]).checksum(FAST_HASH) == e.fast:
+                self.record(tgt, rel, e.checksum, e.fast)
+                return e.checksum
+        return None
+
+    def record(self, tgt, rel, checksum, fast=None):
+        st = os.stat(tgt)
+        entry = self.Entry(self.fingerprint(st), time.time_ns(), checksum, fast or None)
+        with self._lock:
+            self.entries[rel] = entry
+
+    def save(self, keep):
+        """Write the index, dropping files that are no longer in keep."""
+        entries = {rel: e.to_json() for rel, e in self.entries.items() if rel in keep}
+        write_atomic(self.path, json.dumps(entries, sort_keys=True))
+
+
+class GraphCache(object):
+    """Resolved dependencies of upstream CWL documents.
+
+    For each document URL this remembers the secondaryFiles found by
+    scandeps and the nested dep:Dependencies it declares.  An entry is
+    reused only while every file it was resolved from is still locked
+    at the checksum it had when the entry was recorded.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.used = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def lookup(self, upstream, locks, installed=None):
+        """Return the secondaryFiles and dependencies recorded for upstream.
+
+        None is returned unless every file the entry was resolved from is
+        still locked at its recorded checksum and, with installed, unless
+        installed(rel) confirms that each of them is on disk as locked.
+        """
+        e = self.entries.get(upstream)
+        if e is None:
+            return None
+        for rel, checksum in e["checksums"].items():
+            if rel not in locks or locks[rel].get("checksum") != checksum:
+                return None
+        if installed is not None and not all(installed(rel) for rel in e["checksums"]):
+            return None
+        with self._lock:
+            self.used[upstream] = e
+        return e["secondaryFiles"], e["dependencies"]
+
+    def record(self, upstream, files, secondary_files, dependencies):
+        with self._lock:
+            self.used[upstream] = {
+                "files": files,
+                "secondaryFiles": secondary_files,
+                "dependencies": dependencies
+            }
+
+    def save(self, verified):
+        """Write the entries used in this run whose files were all verified.
+
+        An entry reused from the previous run keeps the checksums it was
+        resolved from, and is dropped if any of its files changed since.
+        """
+        entries = {}
+        for upstream, e in self.used.items():
+            if "checksums" in e:
+                checksums = e["checksums"]
+                if any(verified.get(rel, {}).get("checksum") != checksum for rel, checksum in checksums.items()):
+                    continue
+            else:
+                if not all(verified.get(rel, {}).get("checksum") for rel in e["files"]):
+                    continue
+                checksums = {rel: verified[rel]["checksum"] for rel in e["files"]}
+            entries[upstream] = {
+                "checksums": checksums,
+                "secondaryFiles": e["secondaryFiles"],
+                "dependencies": e["dependencies"]
+            }
+        write_atomic(self.path, json.dumps(entries, sort_keys=True))
+
+
+def canonical_url(url):
+    """Spell url the same way as every equivalent URL."""
+    sp = urllib.parse.urlsplit(url)
+    scheme = sp.scheme.lower()
+    netloc = sp.netloc.lower()
+    if (scheme, netloc.rpartition(":")[2]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rpartition(":")[0]
+    path = posixpath.normpath(sp.path) if sp.path else ""
+    if path.startswith("//"):
+        path = "/" + path.lstrip("/")
+    return urllib.parse.urlunsplit((scheme, netloc, path, sp.query, ""))
+
+
+class DependencyGraph(object):
+    """The dependencies of one workflow resolved in a run.
+
+    Each node is an upstream at a version installed to a directory, and
+    is resolved once however many documents require it.  Every file is
+    retrieved once, even when several nodes list it.  A dependency that
+    requires one of the upstreams it was required by is a cycle and is
+    not followed.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.files = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(upstream, version, install_to):
+        return (canonical_url(upstream), version or "", os.path.relpath(install_to, os.getcwd()))
+
+    def add(self, key, parent):
+        """Record that parent requires key; return True if key is new."""
+        with self._lock:
+            if parent is not None and key not in self.nodes[parent]["requires"]:
+                self.nodes[parent]["requires"].append(key)
+            if key in self.nodes:
+                return False
+            self.nodes[key] = {"parent": parent, "requires": []}
+            return True
+
+    def cycle(self, upstream, parent):
+        """Return the chain of upstreams from upstream back to itself through parent, if any."""
+        chain = [canonical_url(upstream)]
+        with self._lock:
+            while parent is not None:
+                chain.append(parent[0])
+                if parent[0] == chain[0]:
+                    return list(reversed(chain))
+                parent = self.nodes[parent]["parent"]
+        return None
+
+    def claim_file(self, path):
+        """Return True the first time path is claimed for retrieval."""
+        with self._lock:
+            if path in self.files:
+                return False
+            self.files.add(path)
+            return True
+
+    def plan(self):
+        """Return the nodes ordered so that each comes after those it requires."""
+        order = []
+        done = set()
+
+        def visit(key):
+            if key in done:
+                return
+            done.add(key)
+            for r in self.nodes[key]["requires"]:
+                visit(r)
+            order.append(key)
+
+        for key in sorted(self.nodes):
+            visit(key)
+        return [{"upstream": k[0], "version": k[1], "install_to": k[2],
+                 "requires": [r[0] for r in self.nodes[k]["requires"]]} for k in order]
+
+
+class Batch(object):
+    """Work shared by every workflow resolved in one run.
+
+    Upstream documents are scanned, and checked upstreams fetched, once
+    per URL.  A path that several
+    workflows install is installed by the first of them, and the others
+    lock the entry it was installed with.  The first path each file or
+    archive URL is installed to is remembered, so that other paths can
+    be copied or linked from it, and so are all the paths of each file.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.checksums = {}
+        self.entries = {}
+        self.copies = {}
+        self.places = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def document(self, upstream, scan):
+        """Return scan() for upstream, calling it only once per URL."""
+        url = canonical_url(upstream)
+        with self._key_lock(("document", url)):
+            if url not in self.documents:
+                self.documents[url] = scan()
+            return self.documents[url]
+
+    def upstream_checksum(self, url, algorithm, fetch):
+        """Return fetch(), the checksum of url in algorithm, calling it
+        only once per URL and algorithm."""
+        key = (canonical_url(url), algorithm)
+        with self._key_lock(("checksum",) + key):
+            if key not in self.checksums:
+                self.checksums[key] = fetch()
+            return self.checksums[key]
+
+    def record(self, rel, entry):
+        with self._lock:
+            self.entries[rel] = entry
+
+    def first_copy(self, url, rel, fetch):
+        """Return the path url was first installed to in this run.
+
+        If there is none yet, fetch() installs url at rel, which becomes
+        that path once it is recorded.
+        """
+        url = canonical_url(url)
+        with self._key_lock(("copy", url)):
+            if url not in self.copies:
+                fetch()
+                with self._lock:
+                    if rel in self.entries:
+                        self.copies[url] = rel
+            return self.copies.get(url)
+
+    def add_place(self, url, rel):
+        """Remember that the file url is installed at rel."""
+        with self._lock:
+            places = self.places.setdefault(canonical_url(url), [])
+            if rel not in places:
+                places.append(rel)
+
+    def list_places(self, verified):
+        """Make the entry of each file installed in this run list, in
+        installed_to, every path of verified the file is installed at."""
+        with self._lock:
+            groups = [list(places) for places in self.places.values()]
+        for places in groups:
+            rels = [rel for rel in places if rel in verified]
+            for rel in rels:
+                verified[rel] = dict(verified[rel], installed_to=rels)
+
+    def install(self, rel, install, verified, context):
+        """Call install() unless rel was already installed in this run,
+        and record the entry it was installed with in verified."""
+        with self._key_lock(("install", rel)):
+            with self._lock:
+                entry = self.entries.get(rel)
+            if entry is None:
+                install()
+                return
+        context.record(verified, rel, entry)
+
+
+def makedirs(path):
+    # Several workers may create the same directory at once.
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def download(tgt, url, version, locks, verified, check_only, context=None):
+    context = context or DepContext()
     dltgt = tgt + "_download_"
 
     rel = os.path.relpath(tgt, os.getcwd())
@@ -41,170 +530,1048 @@ def download(tgt, url, version, locks, verified, check_only):
     logging.info("Fetching %s to %s", url, rel)
 
     if check_only:
-        if not os.path.isfile(tgt) or rel not in locks:
+        if not is_installed(rel, locks):
             logging.error("Need install %s", rel)
             return
+        # Workflows of one run that lock the same upstream fetch it once.
+        locked = locks[rel]["checksum"]
+        current = context.batch.upstream_checksum(
+            url, checksum_algorithm(locked), lambda: fetch_checksum(dltgt, url, rel, locks, context))
+        if current != locked:
+            logging.warn("Upstream has changed: %s", rel)
+        else:
+            logging.info("Up to date: %s", rel)
+        return
 
-    with open(dltgt, "wb") as f:
-        h = hashlib.sha1()
-        with requests.get(url, stream=True) as r:
-            for content in r.iter_content(2**16):
-                h.update(content)
-                f.write(content)
-        checksum = h.hexdigest()
+    headers = conditional_headers(rel, locks, verified, False)
 
+    with context.tracer.span("download", url=url, bytes=0) as span, \
+            get_resuming(dltgt, url, headers, context) as (r, offset):
+        span["status"] = r.status_code
+        span["ttfb"] = r.elapsed.total_seconds()
+        if headers and r.status_code == 304:
+            logging.info("Up to date: %s", rel)
+            return
+        r.raise_for_status()
+        h = Digests(context.algorithms(rel, locks))
+        try:
+            if offset:
+                span["resumed_from"] = offset
+                with open(dltgt, "rb") as f:
+                    hash_file(f, h)
+            with open(dltgt, "ab" if offset else "wb") as f:
+                for content in r.iter_content(2**20):
+                    h.update(content)
+                    f.write(content)
+                    span["bytes"] += len(content)
+        except BaseException:
+            if not is_resumable(dltgt):
+                discard_partial(dltgt)
+            raise
+        checksum = h.checksum(context.hash_algorithm)
+        response_headers = r.headers
+
+    if offset and rel in locks and h.checksum(checksum_algorithm(locks[rel]["checksum"])) != locks[rel]["checksum"]:
+        # The part already downloaded may be corrupt, so fetch it all
+        # before deciding whether upstream changed.
+        logging.info("Resumed download of %s does not match the lock, fetching it again", rel)
+        discard_partial(dltgt)
+        return download(tgt, url, version, locks, verified, check_only, context)
+
+    if report_changed(rel, locks, h) and context.frozen:
+        discard_partial(dltgt)
+        raise LockMismatch("%s does not match the lock file" % rel)
+
+    os.rename(dltgt, tgt)
+    discard_partial(dltgt)
+
+    if context.cache is not None:
+        context.cache.store(tgt, checksum, url)
+
+    if context.stat_index is not None:
+        context.stat_index.record(tgt, rel, checksum, h.checksum(FAST_HASH))
+
+    context.record(verified, rel, lock_entry(url, version, checksum, [rel], response_headers))
+
+
+def fetch_checksum(dltgt, url, rel, locks, context):
+    """Return the checksum of url in the algorithm of the one locked for rel.
+
+    When the server says url was not modified since it was locked, the
+    locked checksum is returned.
+    """
+    locked = locks[rel]["checksum"]
+    headers = conditional_headers(rel, locks, {}, True)
+    with context.tracer.span("download", url=url, bytes=0) as span, \
+            get_resuming(dltgt, url, headers, context, False) as (r, offset):
+        span["status"] = r.status_code
+        span["ttfb"] = r.elapsed.total_seconds()
+        if headers and r.status_code == 304:
+            return locked
+        r.raise_for_status()
+        h = Digests([checksum_algorithm(locked)])
+        try:
+            with open(dltgt, "wb") as f:
+                for content in r.iter_content(2**20):
+                    h.update(content)
+                    f.write(content)
+                    span["bytes"] += len(content)
+        finally:
+            discard_partial(dltgt)
+    return h.checksum(checksum_algorithm(locked))
+
+
+def resume_headers(dltgt, url):
+    """Return the headers resuming the partial download of url at dltgt,
+    and the number of bytes it already has."""
+    try:
+        with open(dltgt + ".json", "r") as f:
+            partial = json.load(f)
+        size = os.path.getsize(dltgt)
+    except (IOError, OSError, ValueError):
+        return {}, 0
+    if partial.get("url") != url or not partial.get("validator") or not size:
+        return {}, 0
+    # The partial download holds decoded bytes, which the ranges of the
+    # unencoded representation address.
+    return {"Range": "bytes=%d-" % size, "If-Range": partial["validator"],
+            "Accept-Encoding": "identity"}, size
+
+
+def remember_partial(dltgt, url, r):
+    """Record what is needed to resume the download of url at dltgt, if the server allows it."""
+    etag = r.headers.get("ETag")
+    # Weak validators cannot be used with If-Range.
+    validator = etag if etag and not etag.startswith("W/") else r.headers.get("Last-Modified")
+    if r.status_code == 200 and r.headers.get("Accept-Ranges") == "bytes" and validator:
+        with open(dltgt + ".json", "w") as f:
+            json.dump({"url": url, "validator": validator}, f)
+    elif os.path.isfile(dltgt + ".json"):
+        os.remove(dltgt + ".json")
+
+
+def is_resumable(dltgt):
+    return os.path.isfile(dltgt + ".json")
+
+
+def discard_partial(dltgt):
+    # Without its record a partial download is never resumed.
+    for p in (dltgt + ".json", dltgt):
+        if os.path.isfile(p):
+            os.remove(p)
+
+
+@contextlib.contextmanager
+def get_resuming(dltgt, url, headers, context, resume=True):
+    """Request url, resuming the partial download at dltgt when possible.
+
+    Yields the response and the number of bytes of dltgt it follows, or
+    0 when the download starts over.  A partial download is resumed
+    only if the server advertised byte ranges for it and it has not
+    changed since; otherwise it is fetched in full.  Conditional
+    requests, which revalidate an installed copy, are never resumed.
+    """
+    range_headers, offset = resume_headers(dltgt, url) if resume and not headers else ({}, 0)
+    if offset:
+        with context.session.get(url, stream=True, headers=range_headers, timeout=context.timeout) as r:
+            if r.status_code == 206 and r.headers.get("Content-Range", "").startswith("bytes %d-" % offset):
+                logging.info("Resuming %s from byte %d", url, offset)
+                yield r, offset
+                return
+            if r.status_code not in (206, 416):
+                remember_partial(dltgt, url, r)
+                yield r, 0
+                return
+        discard_partial(dltgt)
+    with context.session.get(url, stream=True, headers=headers, timeout=context.timeout) as r:
+        if resume:
+            remember_partial(dltgt, url, r)
+        yield r, 0
+
+
+class HashingReader(object):
+    """Read-only file wrapper that hashes, and optionally copies, what is read.
+
+    The bytes of prefix, such as the part of a download already on
+    disk, are read first and hashed but not copied.
+    """
+
+    def __init__(self, raw, h, copy=None, prefix=None):
+        self.raw = raw
+        self.h = h
+        self.copy = copy
+        self.prefix = prefix
+        self.count = 0
+
+    def read(self, size=-1):
+        if self.prefix is not None:
+            data = self.prefix.read(size)
+            if data:
+                self.h.update(data)
+                self.count += len(data)
+                return data
+            self.prefix = None
+        data = self.raw.read(size)
+        self.h.update(data)
+        self.count += len(data)
+        if self.copy is not None:
+            self.copy.write(data)
+        return data
+
+    def drain(self):
+        while self.read(2**20):
+            pass
+
+
+def extract_archive(fileobj, install_to, is_zip, include=None, jobs=1):
+    """Extract a tar (read as a stream) or zip archive; return the member names.
+
+    With include, only members whose path matches one of its glob
+    patterns are extracted.  Zip members are decompressed on up to jobs
+    threads.
+    """
+    import tarfile
+    import zipfile
+
+    def wanted(name):
+        return not include or any(fnmatch.fnmatchcase(name, pattern) for pattern in include)
+
+    if is_zip:
+        with zipfile.ZipFile(fileobj) as z:
+            members = [m for m in z.infolist() if wanted(m.filename)]
+            if jobs > 1 and len(members) > 1:
+                # Make the directories first so the workers do not race
+                # to create them.
+                for m in members:
+                    parts = [p for p in m.filename.split("/") if p not in ("", ".", "..")]
+                    if len(parts) > 1 or m.is_dir():
+                        makedirs(os.path.join(install_to, *(parts if m.is_dir() else parts[:-1])))
+                with ThreadPoolExecutor(jobs) as executor:
+                    list(executor.map(lambda m: z.extract(m, install_to), members))
+            else:
+                for m in members:
+                    z.extract(m, install_to)
+            return [m.filename for m in members]
+    with tarfile.open(fileobj=fileobj, mode="r|*") as t:
+        if not include:
+            t.extractall(install_to)
+            return t.getnames()
+        names = []
+        for m in t:
+            if wanted(m.name):
+                t.extract(m, install_to)
+                names.append(m.name)
+        return names
+
+
+def download_archive(tgt, url, install_to, locks, verified, context, include=None):
+    """Download an archive, extracting it while it streams in.
+
+    The archive is hashed as it is read and is written to disk only when
+    it is kept at tgt or stored in the download cache.  Zip archives
+    must be read from the end, and frozen installs must match the lock
+    before anything is extracted, so otherwise they are spooled to a
+    temporary file.  Returns the lock entry and the archive member
+    names, or None when the server says the verified copy at tgt is
+    not modified.
+    """
+    import tempfile
+    dltgt = tgt + "_download_"
+    rel = os.path.relpath(tgt, os.getcwd())
+    is_zip = url.endswith(".zip")
+
+    logging.info("Fetching %s to %s", url, rel)
+
+    headers = conditional_headers(rel, locks, verified, False)
+    # Only an archive written to disk leaves a partial download to resume.
+    write = context.keep_archives or context.cache is not None
+
+    with context.tracer.span("download+extract", url=url) as span, \
+            get_resuming(dltgt, url, headers, context, write) as (r, offset):
+        span["status"] = r.status_code
+        span["ttfb"] = r.elapsed.total_seconds()
+        if headers and r.status_code == 304:
+            logging.info("Up to date: %s", rel)
+            return None
+        r.raise_for_status()
+        r.raw.decode_content = True
+
+        h = Digests(context.algorithms(rel, locks))
+        try:
+            with (open(dltgt, "a+b" if offset else "w+b") if write else
+                  tempfile.SpooledTemporaryFile(2**26, dir=install_to)) as f, \
+                    (open(dltgt, "rb") if offset else contextlib.closing(io.BytesIO())) as prefix:
+                if offset:
+                    span["resumed_from"] = offset
+                # A frozen install checks the whole archive against the lock
+                # before extracting anything over the locked tree.
+                buffered = is_zip or context.frozen
+                reader = HashingReader(r.raw, h, f if write or buffered else None, prefix)
+                if buffered:
+                    reader.drain()
+                    names = None
+                    if not (context.frozen and rel in locks and
+                            h.checksum(checksum_algorithm(locks[rel]["checksum"])) != locks[rel]["checksum"]):
+                        f.seek(0)
+                        names = extract_archive(f, install_to, is_zip, include, context.pool.jobs)
+                else:
+                    names = extract_archive(reader, install_to, False, include)
+                    reader.drain()
+        except BaseException:
+            if write and not is_resumable(dltgt):
+                discard_partial(dltgt)
+            raise
+        checksum = h.checksum(context.hash_algorithm)
+        span["bytes"] = reader.count - offset
+        response_headers = r.headers
+
+    if offset and rel in locks and h.checksum(checksum_algorithm(locks[rel]["checksum"])) != locks[rel]["checksum"]:
+        logging.info("Resumed download of %s does not match the lock, fetching it again", rel)
+        discard_partial(dltgt)
+        return download_archive(tgt, url, install_to, locks, verified, context, include)
+
+    if report_changed(rel, locks, h) and context.frozen:
+        if write:
+            discard_partial(dltgt)
+        raise LockMismatch("%s does not match the lock file" % rel)
+
+    installed_to = []
+    if write:
+        if context.cache is not None:
+            context.cache.store(dltgt, checksum, url)
+        if context.keep_archives:
+            os.rename(dltgt, tgt)
+            installed_to.append(rel)
+            if context.stat_index is not None:
+                context.stat_index.record(tgt, rel, checksum, h.checksum(FAST_HASH))
+        discard_partial(dltgt)
+
+    return lock_entry(url, "", checksum, installed_to, response_headers), names
+
+
+def is_installed(rel, locks):
+    return rel in locks and all(os.path.exists(p) for p in locks[rel].get("installed_to", [rel]))
+
+
+def conditional_headers(rel, locks, verified, check_only):
+    # Only revalidate when the local copy is known to match the lock.
+    headers = {}
+    if rel in locks and (check_only or rel in verified):
+        if locks[rel].get("etag"):
+            headers["If-None-Match"] = locks[rel]["etag"]
+        if locks[rel].get("last_modified"):
+            headers["If-Modified-Since"] = locks[rel]["last_modified"]
+    return headers
+
+
+def report_changed(rel, locks, digests):
+    """Log whether rel differs from its locked checksum; return True if it does."""
     if rel in locks:
-        if locks[rel]["checksum"] != checksum:
+        locked = locks[rel]["checksum"]
+        if digests.checksum(checksum_algorithm(locked)) != locked:
             logging.warn("Upstream has changed: %s", rel)
+            return True
         else:
             logging.info("Up to date: %s", rel)
+    return False
 
-    if check_only:
-        os.remove(dltgt)
-        return
 
-    os.rename(dltgt, tgt)
+def lock_algorithm(locks):
+    """Return the checksum algorithm most entries of locks use."""
+    counts = {}
+    for entry in locks.values():
+        if entry.get("checksum"):
+            algorithm = checksum_algorithm(entry["checksum"])
+            counts[algorithm] = counts.get(algorithm, 0) + 1
+    if not counts:
+        return DEFAULT_HASH_ALGORITHM
+    return max(sorted(counts), key=lambda a: counts[a])
 
-    rel = os.path.relpath(tgt, os.getcwd())
-    verified[rel] = {
+
+def lock_entry(url, version, checksum, installed_to, headers):
+    entry = {
         "upstream": url,
         "version": version,
         "checksum": checksum,
         "retrieved_at": datetime.now(tzlocal()).isoformat(),
-        "installed_to": [rel]
+        "installed_to": installed_to
     }
+    if headers.get("ETag"):
+        entry["etag"] = headers.get("ETag")
+    if headers.get("Last-Modified"):
+        entry["last_modified"] = headers.get("Last-Modified")
+    return entry
+
+
+def checksum_algorithm(checksum):
+    """Return the algorithm of a lock file checksum.
+
+    Checksums are written as "algorithm:hexdigest", except sha1 which
+    is a bare hexdigest as in lock files from before the algorithm was
+    selectable.
+    """
+    if ":" in checksum:
+        return checksum.split(":", 1)[0]
+    return "sha1"
+
+
+class Digests(object):
+    """Several digests of the same data, computed in one pass."""
+
+    def __init__(self, algorithms):
+        self.hashes = {}
+        for algorithm in algorithms:
+            if algorithm in self.hashes:
+                continue
+            if algorithm == FAST_HASH:
+                if xxhash is not None:
+                    self.hashes[algorithm] = xxhash.xxh3_128()
+            elif algorithm in HASH_ALGORITHMS:
+                self.hashes[algorithm] = getattr(hashlib, algorithm)()
+            else:
+                raise ValueError("Unsupported hash algorithm: %s" % algorithm)
+
+    def update(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+
+    def checksum(self, algorithm):
+        if algorithm not in self.hashes:
+            return None
+        digest = self.hashes[algorithm].hexdigest()
+        return digest if algorithm == "sha1" else "%s:%s" % (algorithm, digest)
+
+
+def hash_file(f, h):
+    # A single reused buffer keeps large files from churning allocations.
+    buf = bytearray(2**20)
+    view = memoryview(buf)
+    n = f.readinto(buf)
+    while n:
+        h.update(view[:n])
+        n = f.readinto(buf)
+
 
+def file_digests(path, algorithms):
+    h = Digests(algorithms)
+    with open(path, "rb") as f:
+        hash_file(f, h)
+    return h
 
-def verify(tgt, locks, verified):
+
+def file_checksum(path, algorithm=DEFAULT_HASH_ALGORITHM):
+    return file_digests(path, [algorithm]).checksum(algorithm)
+
+
+def verify(tgt, locks, verified, context=None):
+    context = context or DepContext()
     rel = os.path.relpath(tgt, os.getcwd())
 
     if not os.path.isfile(tgt) or rel not in locks:
         return False
 
-    h = hashlib.sha1()
-    with open(tgt, "rb") as f:
-        content = f.read(2**16)
-        while content:
-            h.update(content)
-            content = f.read(2**16)
-    if h.hexdigest() == locks[rel]["checksum"]:
-        verified[rel] = locks[rel]
-        return True
+    locked = locks[rel]["checksum"]
+    with context.tracer.span("verify", url=locks[rel].get("upstream", rel)) as span:
+        checksum = None
+        if context.stat_index is not None and not context.paranoid:
+            checksum = context.stat_index.lookup(tgt, rel)
+            span["cache"] = "miss" if checksum is None else "hit"
+
+        if checksum is None or checksum_algorithm(checksum) != checksum_algorithm(locked) or (
+                checksum == locked and checksum_algorithm(locked) != context.hash_algorithm):
+            # Hash the file, also in the lock file's algorithm when the
+            # entry is being migrated to it.
+            h = file_digests(tgt, context.algorithms(rel, locks))
+            span["bytes"] = os.path.getsize(tgt)
+            if h.checksum(checksum_algorithm(locked)) != locked:
+                return False
+            checksum = h.checksum(context.hash_algorithm)
+            if context.stat_index is not None:
+                context.stat_index.record(tgt, rel, checksum, h.checksum(FAST_HASH))
+        elif checksum != locked:
+            return False
+
+    if checksum == locked:
+        context.record(verified, rel, locks[rel])
     else:
-        return False
+        context.record(verified, rel, dict(locks[rel], checksum=checksum))
+    return True
 
 
-def load_nocheck(upstream):
-    loading_context, workflowobj, uri = cwltool.load_tool.fetch_document(upstream)
+def fetch_cached(tgt, url, locks, verified, context):
+    """Install the locked version of tgt from the download cache."""
+    rel = os.path.relpath(tgt, os.getcwd())
 
-    (sch_document_loader, avsc_names) = \
-        get_schema(workflowobj["cwlVersion"])[:2]
+    if context.cache is None or rel not in locks or locks[rel]["upstream"] != url:
+        return False
 
-    cp = sch_document_loader.ctx.copy()
-    cp["upstream"] = {
-        "@type": "@id"
-    }
-    sch_document_loader = schema_salad.ref_resolver.Loader(cp)
+    checksum = locks[rel]["checksum"]
+    with context.tracer.span("cache fetch", url=url) as span:
+        found = context.cache.fetch(checksum, url, tgt)
+        span["cache"] = "hit" if found else "miss"
+    if not found:
+        return False
+    if verify(tgt, locks, verified, context):
+        logging.info("Installed %s from cache", rel)
+        return True
 
-    document, metadata = sch_document_loader.resolve_all(workflowobj, uri, checklinks=False)
+    logging.warn("Cached copy of %s is corrupt, discarding", rel)
+    context.cache.discard(checksum)
+    return False
+
+
+def schema_context(cwl_version, cache_dir=None):
+    """Return the JSON-LD context of the CWL schema for cwl_version.
+
+    The context is extended so that `upstream` is resolved as an
+    identifier.  It is built once per process, and when cache_dir is
+    given it is also saved there so later runs skip loading the schema.
+    """
+    with _schema_lock:
+        if cwl_version in _schema_contexts:
+            return _schema_contexts[cwl_version]
+
+        cached = None
+        if cache_dir is not None:
+            from importlib.metadata import version
+            cached = os.path.join(cache_dir, "schema", version("cwltool"),
+                                  re.sub(r"[^\w.-]", "_", cwl_version) + ".json")
+            if os.path.isfile(cached):
+                with open(cached, "r") as f:
+                    _schema_contexts[cwl_version] = json.load(f)
+                return _schema_contexts[cwl_version]
+
+        from cwltool.process import get_schema
+        cp = get_schema(cwl_version)[0].ctx.copy()
+        cp["upstream"] = {
+            "@type": "@id"
+        }
+        _schema_contexts[cwl_version] = cp
+
+        if cached is not None:
+            makedirs(os.path.dirname(cached))
+            with open(cached + "_", "wt") as f:
+                json.dump(cp, f)
+            os.rename(cached + "_", cached)
+        return cp
+
+
+def load_nocheck(upstream, context=None):
+    import cwltool.context
+    import cwltool.load_tool
+    import schema_salad.fetcher
+    import schema_salad.ref_resolver
+
+    fetcher_constructor = None
+    if context is not None:
+        def fetcher_constructor(cache, session):
+            return schema_salad.fetcher.DefaultFetcher(cache, context.session)
+
+    tracer = context.tracer if context is not None else trace.NULL
+    with tracer.span("load", url=upstream):
+        loading_context, workflowobj, uri = cwltool.load_tool.fetch_document(
+            upstream, cwltool.context.LoadingContext({"fetcher_constructor": fetcher_constructor}))
+
+        # resolve_all() fills in the loader's index, so each document gets
+        # its own loader built from the shared schema context.
+        cache_dir = context.cache.root if context is not None and context.cache is not None else None
+        cp = schema_context(workflowobj["cwlVersion"], cache_dir)
+        sch_document_loader = schema_salad.ref_resolver.Loader(cp, fetcher_constructor=fetcher_constructor)
+
+        document, metadata = sch_document_loader.resolve_all(workflowobj, uri, checklinks=False)
 
     return document, loading_context
 
 
-def cwl_deps(basedir, dependencies, locks, verified, operation):
+def cwl_deps(basedir, dependencies, locks, verified, operation, context=None, parent=None):
+    context = context or DepContext()
     for d in dependencies["dependencies"]:
-        upstream = d["upstream"]
-        spup = urllib.parse.urlsplit(upstream)
+        context.pool.submit(resolve_dep, basedir, d, locks, verified, operation, context, parent)
+
+
+def scan_document(upstream, locks, verified, operation, context):
+    """Return the secondaryFiles and nested dep:Dependencies of upstream,
+    and whether they came from the workflow's graph cache.
+
+    A graph cache entry is only used while the files it was resolved
+    from are installed as locked; otherwise the upstream document, which
+    is then fetched again, may have changed.  Documents that are not in
+    the graph cache are scanned once per run, however many workflows
+    require them.
+    """
+    if context.graph is not None and operation not in ("update", "check"):
+        with context.tracer.span("graph lookup", url=upstream) as span:
+            cached = context.graph.lookup(upstream, locks, lambda rel: verify(rel, locks, verified, context))
+            span["cache"] = "miss" if cached is None else "hit"
+        if cached is not None:
+            return cached[0], cached[1], True
+
+    sfs, nested = context.batch.document(upstream, lambda: scan(upstream, context))
+    return sfs, nested, False
+
+
+def scan(upstream, context):
+    """Load upstream and return its secondaryFiles and nested dep:Dependencies."""
+    from cwltool.process import scandeps
+    from cwltool.utils import visit_class
+
+    document, loading_context = load_nocheck(upstream, context)
+
+    def loadref(base, uri):
+        return loading_context.loader.fetch(loading_context.loader.fetcher.urljoin(base, uri))
+
+    loading_context.loader.idx = {}
 
-        if d.get("installTo"):
-            installTo = os.path.join(basedir, d.get("installTo"))
+    with context.tracer.span("scandeps", url=upstream):
+        sfs = scandeps(
+            upstream, loading_context.loader.fetch(upstream), {"$import", "run"},
+            {"$include", "$schemas", "location"}, loadref)
+
+    nested = []
+    visit_class(document, (CWLDEP_DEPENDENCIES_URL,), nested.append)
+    return sfs, nested
+
+
+def resolve_dep(basedir, d, locks, verified, operation, context, parent=None):
+    upstream = d["upstream"]
+    spup = urllib.parse.urlsplit(upstream)
+
+    if d.get("installTo"):
+        installTo = os.path.join(basedir, d.get("installTo"))
+    else:
+        installTo = os.path.dirname(os.path.join(basedir, spup.netloc, spup.path.lstrip("/")))
+
+    include = d.get("include")
+    if isinstance(include, str):
+        include = [include]
+    elif include is not None and not isinstance(include, list):
+        logging.error("include of %s must be a glob pattern or a list of them", upstream)
+        return
+
+    cycle = context.resolved.cycle(upstream, parent)
+    if cycle is not None:
+        logging.error("Dependency cycle: %s", " -> ".join(cycle))
+        return
+    node = context.resolved.key(upstream, d.get("version"), installTo)
+    if not context.resolved.add(node, parent):
+        return
+
+    if operation not in ("graph", "check") and not context.dry_run and not os.path.isdir(installTo):
+        makedirs(installTo)
+
+    def install(tgt, fn):
+        rel = os.path.relpath(tgt, os.getcwd())
+        if context.dry_run:
+            # Nothing is fetched; a referenced entry is taken from the lock.
+            if rel in locks:
+                context.record(verified, rel, locks[rel])
+        # Each workflow checks against its own lock.
+        elif operation == "check":
+            fn()
         else:
-            installTo = os.path.dirname(os.path.join(basedir, spup.netloc, spup.path.lstrip("/")))
+            context.batch.install(rel, fn, verified, context)
 
-        if not os.path.isdir(installTo):
-            os.makedirs(installTo)
+    if spup.scheme == "http" or spup.scheme == "https":
+        tgt = os.path.join(installTo, os.path.basename(spup.path))
 
-        if spup.scheme == "http" or spup.scheme == "https":
-            tgt = os.path.join(installTo, os.path.basename(spup.path))
+        if spup.path.endswith(".cwl"):
+            from cwltool.utils import visit_class
 
-            if spup.path.endswith(".cwl"):
-                deps = {"class": "File", "location": upstream}  # type: Dict[Text, Any]
+            deps = {"class": "File", "location": upstream}  # type: Dict[Text, Any]
 
-                document, loading_context = load_nocheck(upstream)
+            def target(location):
+                sploc = urllib.parse.urlsplit(location)
+                return os.path.join(installTo, os.path.relpath(sploc.path, os.path.dirname(spup.path)))
 
-                def loadref(base, uri):
-                    return loading_context.loader.fetch(loading_context.loader.fetcher.urljoin(base, uri))
+            sfs, nested, cached = scan_document(upstream, locks, verified, operation, context)
 
-                loading_context.loader.idx = {}
+            if sfs:
+                deps["secondaryFiles"] = sfs
 
-                sfs = scandeps(
-                    upstream, loading_context.loader.fetch(upstream), {"$import", "run"},
-                    {"$include", "$schemas", "location"}, loadref)
-                if sfs:
-                    deps["secondaryFiles"] = sfs
+            if not cached and context.graph is not None:
+                files = []
+                visit_class(deps, ("File",), lambda obj: files.append(
+                    os.path.relpath(target(obj["location"]), os.getcwd())))
+                context.graph.record(upstream, files, sfs, nested)
 
-                def retrieve(obj):
-                    sploc = urllib.parse.urlsplit(obj["location"])
-                    rp = os.path.relpath(sploc.path, os.path.dirname(spup.path))
-                    tgt = os.path.join(installTo, rp)
-                    if not os.path.isdir(os.path.dirname(tgt)):
-                        os.makedirs(os.path.dirname(tgt))
-                    if verify(tgt, locks, verified) and operation not in ("update", "check"):
-                        return
-                    download(tgt, obj["location"], "", locks, verified, operation=="check")
+            def fetch(tgt, location):
+                if verify(tgt, locks, verified, context) and operation not in ("update", "check"):
+                    return
+                if operation == "install" and fetch_cached(tgt, location, locks, verified, context):
+                    return
+                download(tgt, location, "", locks, verified, operation=="check", context)
 
-                visit_class(deps, ("File",), retrieve)
+            def retrieve(obj):
+                tgt = target(obj["location"])
+                if not context.resolved.claim_file(os.path.abspath(tgt)):
+                    return
+                if operation != "check" and not context.dry_run and not os.path.isdir(os.path.dirname(tgt)):
+                    makedirs(os.path.dirname(tgt))
+                if operation == "check":
+                    install(tgt, lambda: fetch(tgt, obj["location"]))
+                else:
+                    install(tgt, lambda: link_file(tgt, obj["location"], locks, verified, context,
+                                                   lambda: fetch(tgt, obj["location"])))
 
-                def do_deps(req):
-                    cwl_deps(installTo, req, locks, verified, operation)
+            if operation != "graph":
+                visit_class(deps, ("File",), lambda obj: context.pool.submit(retrieve, obj))
 
-                visit_class(document, (CWLDEP_DEPENDENCIES_URL,), do_deps)
+            for req in nested:
+                cwl_deps(installTo, req, locks, verified, operation, context, node)
 
-            elif spup.path.endswith(".tar.gz") or spup.path.endswith(".tar.bz2") or spup.path.endswith(".zip"):
-                download(tgt, upstream, "", locks, verified, operation=="check")
-                if spup.path.endswith(".tar.gz"):
-                    with tarfile.open(tgt) as t:
-                        t.extractall(installTo)
-                elif spup.path.endswith(".tar.bz2"):
-                    with tarfile.open(tgt) as t:
-                        t.extractall(installTo)
-                elif spup.path.endswith(".zip"):
-                    with zipfile.ZipFile(tgt) as z:
-                        z.extractall(installTo)
-                rel = os.path.relpath(tgt, os.getcwd())
-                verified[rel]["installed_to"] = [tgt, os.path.relpath(ex, os.getcwd())]
+        elif operation == "graph":
+            return
 
-            else:
-                rq = requests.get(upstream+".git/info/refs?service=git-upload-pack")
-                if rq.status_code == 200:
-                    if os.path.isdir(os.path.join(tgt, ".git")):
-                        subprocess.call(["git", "fetch", "--all"])
-                    else:
-                        subprocess.call(["git", "clone", upstream, tgt])
-
-                    version = d.get("version")
-                    rel = os.path.relpath(tgt, os.getcwd())
-                    if rel in locks and operation != "update":
-                        version = locks[rel]["version"]
-
-                    if version:
-                        print(version)
-                        co = subprocess.check_output(["git", "rev-parse", version], cwd=tgt).rstrip()
-                        head = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=tgt).rstrip()
-                        head = head.rstrip()
-                        if head != co:
-                            subprocess.call(["git", "checkout", co], cwd=tgt)
-                    commit = subprocess.check_output(["git", "rev-parse", "HEAD"]).rstrip().decode('utf-8')
-
-                    verified[rel] = {
-                        "upstream": upstream,
-                        "version": commit,
-                        "retrieved_at": datetime.now(tzlocal()).isoformat(),
-                        "installed_to": [rel]
-                    }
+        elif is_archive(spup.path) and operation == "check":
+            install(tgt, lambda: install_archive(tgt, upstream, installTo, locks, verified, operation, context,
+                                                 include))
+
+        elif is_archive(spup.path):
+            install(tgt, lambda: link_archive(tgt, upstream, installTo, locks, verified, operation, context,
+                                              include))
+
+        elif context.dry_run:
+            install(tgt, None)
 
         else:
-            logging.error("Scheme %s not supported", spup.scheme)
+            rq = context.session.get(upstream+".git/info/refs?service=git-upload-pack", timeout=context.timeout)
+            if rq.status_code == 200 and operation == "check":
+                check_git(upstream, tgt, d.get("version"), locks, verified, context,
+                          git.parse_advertisement(rq.content))
+            elif rq.status_code == 200:
+                install(tgt, lambda: install_git(upstream, tgt, d.get("version"), locks, verified, operation, context))
+
+    elif spup.scheme == "file" and git.is_repository(urllib.request.url2pathname(spup.path)):
+        if operation == "graph":
+            return
+        tgt = os.path.join(installTo, os.path.basename(spup.path.rstrip("/")))
+        if operation == "check":
+            check_git(upstream, tgt, d.get("version"), locks, verified, context)
+        else:
+            install(tgt, lambda: install_git(upstream, tgt, d.get("version"), locks, verified, operation, context))
+
+    else:
+        logging.error("Scheme %s not supported", spup.scheme)
+
+
+def link_file(tgt, url, locks, verified, context, fetch):
+    """Install the file url at tgt, copying or linking it from the copy of
+    url installed first in this run by context.install_strategy, or with
+    fetch() when tgt is that first copy."""
+    rel = os.path.relpath(tgt, os.getcwd())
+    source = context.batch.first_copy(url, rel, fetch)
+    if source is None:
+        return
+    context.batch.add_place(url, rel)
+    if source == rel:
+        return
+    entry = context.batch.entries[source]
+
+    if os.path.lexists(tgt) and verify(tgt, locks, verified, context) and \
+            verified[rel]["checksum"] == entry["checksum"] and \
+            (context.install_strategy in ("copy", "reflink") or os.path.samefile(tgt, source)):
+        return
+
+    logging.info("Linking %s to %s", rel, source)
+    install_file(source, tgt, context.install_strategy)
+    if context.stat_index is not None:
+        context.stat_index.record(tgt, rel, entry["checksum"])
+    context.record(verified, rel, dict(entry, installed_to=[rel]))
+
+
+def is_archive(path):
+    return path.endswith(".tar.gz") or path.endswith(".tar.bz2") or path.endswith(".zip")
+
+
+def link_archive(tgt, upstream, install_to, locks, verified, operation, context, include=None):
+    """Install the archive upstream to tgt like install_archive(), from
+    the copy of it installed first in this run when there is one."""
+    rel = os.path.relpath(tgt, os.getcwd())
+    source = context.batch.first_copy(upstream, rel, lambda: install_archive(
+        tgt, upstream, install_to, locks, verified, operation, context, include))
+    if source is not None and source != rel:
+        install_archive(tgt, upstream, install_to, locks, verified, operation, context, include, source)
+
+
+def install_archive(tgt, upstream, install_to, locks, verified, operation, context, include=None, first=None):
+    """Install the archive upstream to tgt, extracting it into install_to.
+
+    With include, only the members matching its glob patterns are
+    extracted, and each of them is recorded in the lock.  When first is
+    the path the archive was installed to first in this run, the archive
+    is copied or linked from there, or taken from the download cache,
+    instead of being downloaded again.
+    """
+    rel = os.path.relpath(tgt, os.getcwd())
+    is_zip = urllib.parse.urlsplit(upstream).path.endswith(".zip")
+
+    if operation == "check":
+        if rel in locks:
+            context.record(verified, rel, locks[rel])
+        download(tgt, upstream, "", locks, verified, True, context)
+        return
+
+    # A kept archive must still match the lock; a streamed one
+    # left only its extracted files behind.
+    if operation != "update" and is_installed(rel, locks) and locks[rel].get("include") == include and (
+            rel not in locks[rel]["installed_to"] or verify(tgt, locks, verified, context)):
+        context.record(verified, rel, locks[rel])
+        return
+
+    source = None
+    base = locks.get(rel)
+    if first is not None:
+        base = context.batch.entries[first]
+        if verify(tgt, locks, verified, context) and verified[rel]["checksum"] == base["checksum"]:
+            source = tgt
+        elif first in base["installed_to"]:
+            logging.info("Linking %s to %s", rel, first)
+            install_file(first, tgt, context.install_strategy)
+            if context.stat_index is not None:
+                context.stat_index.record(tgt, rel, base["checksum"])
+            source = tgt
+        elif context.cache is not None:
+            source = context.cache.lookup(base["checksum"], upstream)
+    elif verify(tgt, locks, verified, context):
+        source = tgt
+    elif operation == "install" and rel in locks and context.cache is not None:
+        if context.keep_archives:
+            if fetch_cached(tgt, upstream, locks, verified, context):
+                source = tgt
+        else:
+            locked = locks[rel]["checksum"]
+            source = context.cache.lookup(locked, upstream)
+            if source is not None and file_checksum(source, checksum_algorithm(locked)) != locked:
+                logging.warn("Cached copy of %s is corrupt, discarding", rel)
+                context.cache.discard(locks[rel]["checksum"])
+                source = None
+
+    if source is None or (operation == "update" and first is None):
+        downloaded = download_archive(tgt, upstream, install_to, locks, verified, context, include)
+        if downloaded is None and is_installed(rel, locks):
+            return
+        if downloaded is not None:
+            source = None
+            entry, names = downloaded
+
+    if source is not None:
+        logging.info("Extracting %s", os.path.relpath(source, os.getcwd()))
+        with context.tracer.span("extract", url=upstream, bytes=os.path.getsize(source)), \
+                open(source, "rb") as f:
+            names = extract_archive(f, install_to, is_zip, include, context.pool.jobs)
+        entry = dict(base, installed_to=[rel] if source == tgt else [])
+
+    entry = dict(entry)
+    entry.pop("include", None)
+    if include:
+        entry["include"] = include
+        extracted = sorted(set(os.path.normpath(n) for n in names))
+    else:
+        extracted = sorted(set(os.path.normpath(n).split(os.sep)[0] for n in names) - {".", ".."})
+    context.record(verified, rel, dict(entry, installed_to=entry["installed_to"] + [
+        os.path.relpath(os.path.join(install_to, ex), os.getcwd()) for ex in extracted]))
+
+
+def install_git(upstream, tgt, version, locks, verified, operation, context, source=None):
+    rel = os.path.relpath(tgt, os.getcwd())
+    if rel in locks and operation != "update":
+        version = locks[rel]["version"]
+
+    with context.tracer.span("git install", url=upstream):
+        commit = git.checkout(upstream, tgt, version or "HEAD", depth=context.git_depth,
+                              filter_spec=context.git_filter, cache_dir=context.git_cache,
+                              source=source, tracer=context.tracer, timeout=context.timeout)
+
+    context.record(verified, rel, {
+        "upstream": upstream,
+        "version": commit,
+        "retrieved_at": datetime.now(tzlocal()).isoformat(),
+        "installed_to": [rel]
+    })
+
+
+def check_git(upstream, tgt, version, locks, verified, context, refs=None):
+    """Report whether version of upstream moved away from its locked commit.
+
+    Only the refs upstream advertises are read, from refs when the
+    caller already has them or with git ls-remote, and nothing is
+    written to disk.
+    """
+    rel = os.path.relpath(tgt, os.getcwd())
+    if not is_installed(rel, locks):
+        logging.error("Need install %s", rel)
+        return
+    context.record(verified, rel, locks[rel])
+
+    with context.tracer.span("git check", url=upstream):
+        if refs is None and not git.is_commit(version):
+            refs = git.ls_remote(upstream, context.tracer, context.timeout)
+        commit = git.resolve_ref(refs or {}, version or "HEAD")
+    if commit is None:
+        logging.warn("%s does not advertise %s, cannot check %s", upstream, version, rel)
+    elif commit != locks[rel]["version"]:
+        logging.warn("Upstream has changed: %s", rel)
+    else:
+        logging.info("Up to date: %s", rel)
+
+
+def install_frozen(locks, verified, context):
+    """Install exactly the entries of locks, without reading any CWL document.
+
+    Every entry is fetched by its locked URL and version, or taken from
+    context.bundle when there is one; one whose content does not match
+    its locked checksum or commit raises LockMismatch.
+    """
+    for rel in locks:
+        context.pool.submit(install_locked, rel, locks, verified, context)
+
+
+def install_locked(rel, locks, verified, context):
+    context.batch.install(rel, lambda: install_frozen_entry(rel, locks, verified, context), verified, context)
+    entry = locks[rel]
+    if not entry.get("checksum") and verified[rel]["version"] != entry["version"]:
+        raise LockMismatch("%s is not at the locked commit %s" % (rel, entry["version"]))
+
+
+def install_frozen_entry(rel, locks, verified, context):
+    entry = locks[rel]
+    upstream = entry["upstream"]
+    tgt = os.path.join(os.getcwd(), rel)
+    if not os.path.isdir(os.path.dirname(tgt)):
+        makedirs(os.path.dirname(tgt))
+
+    if not entry.get("checksum"):
+        source = None
+        if context.bundle is not None and not git.is_checked_out(tgt, entry["version"], context.tracer):
+            source = tgt + "_bundle_"
+            if not context.bundle.extract_git(entry["version"], source):
+                raise LockMismatch("%s is not in the bundle" % rel)
+        try:
+            install_git(upstream, tgt, entry["version"], locks, verified, "install", context, source)
+        finally:
+            if source is not None:
+                os.remove(source)
+    elif context.bundle is not None:
+        install_bundled(rel, tgt, locks, verified, context)
+    elif is_archive(urllib.parse.urlsplit(upstream).path):
+        install_archive(tgt, upstream, os.path.dirname(tgt), locks, verified, "install", context,
+                        entry.get("include"))
+    elif not verify(tgt, locks, verified, context) and not fetch_cached(tgt, upstream, locks, verified, context):
+        download(tgt, upstream, entry.get("version", ""), locks, verified, False, context)
+
+
+def install_bundled(rel, tgt, locks, verified, context):
+    """Install the locked file or archive rel from context.bundle."""
+    entry = locks[rel]
+    checksum = entry["checksum"]
+    archive = is_archive(urllib.parse.urlsplit(entry["upstream"]).path)
+    kept = rel in entry.get("installed_to", [rel])
+
+    if archive and is_installed(rel, locks) and (not kept or verify(tgt, locks, verified, context)):
+        context.record(verified, rel, entry)
+        return
+    if not archive and verify(tgt, locks, verified, context):
+        return
+
+    # A streamed archive is unpacked from a temporary copy.
+    source = tgt if kept else tgt + "_bundle_"
+    with context.tracer.span("bundle extract", url=entry["upstream"]):
+        if not context.bundle.extract_object(checksum, source):
+            raise LockMismatch("%s is not in the bundle" % rel)
+    try:
+        if kept:
+            matches = verify(tgt, locks, verified, context)
+        else:
+            matches = file_checksum(source, checksum_algorithm(checksum)) == checksum
+        if not matches:
+            raise LockMismatch("%s does not match the lock file" % rel)
+        if archive:
+            with context.tracer.span("extract", url=entry["upstream"], bytes=os.path.getsize(source)), \
+                    open(source, "rb") as f:
+                extract_archive(f, os.path.dirname(tgt), entry["upstream"].endswith(".zip"),
+                                entry.get("include"), context.pool.jobs)
+            context.record(verified, rel, entry)
+    finally:
+        if not kept:
+            os.remove(source)
+
+
+def create_bundle(path, locks, context):
+    """Write every entry of locks to a bundle at path.
+
+    Installed files and checkouts that match the lock are used as they
+    are; anything else is taken from the download cache or fetched.
+    """
+    import tempfile
+    tmpdir = tempfile.mkdtemp(prefix=".cwldep-bundle-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        sources = {}
+        for rel in locks:
+            context.pool.submit(bundle_source, rel, locks, sources, tmpdir, context)
+        context.pool.wait()
+
+        writer = BundleWriter(path)
+        try:
+            with context.tracer.span("bundle write"):
+                for rel in sorted(sources):
+                    entry = locks[rel]
+                    logging.info("Bundling %s", rel)
+                    if entry.get("checksum"):
+                        writer.add_object(entry["checksum"], sources[rel], entry["upstream"])
+                    else:
+                        writer.add_git(entry["version"], sources[rel])
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close(locks)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bundle_source(rel, locks, sources, tmpdir, context):
+    """Find or fetch the locked content of rel for create_bundle."""
+    entry = locks[rel]
+    upstream = entry["upstream"]
+    tgt = os.path.join(os.getcwd(), rel)
+    scratch = os.path.join(tmpdir, hashlib.sha1(rel.encode("utf-8")).hexdigest())
+
+    def found(path):
+        with context.lock:
+            sources[rel] = path
+
+    if not entry.get("checksum"):
+        repo = tgt
+        if not git.is_checked_out(tgt, entry["version"], context.tracer):
+            repo = scratch + ".git"
+            git.checkout(upstream, repo, entry["version"], cache_dir=context.git_cache, tracer=context.tracer,
+                         timeout=context.timeout)
+        git.bundle(repo, entry["version"], scratch, context.tracer)
+        found(scratch)
+        return
+
+    checksum = entry["checksum"]
+    if verify(tgt, locks, {}, context):
+        found(tgt)
+        return
+    if context.cache is not None:
+        cached = context.cache.lookup(checksum, upstream)
+        if cached is not None and file_checksum(cached, checksum_algorithm(checksum)) == checksum:
+            found(cached)
+            return
+
+    logging.info("Fetching %s", upstream)
+    h = Digests([checksum_algorithm(checksum)])
+    with context.tracer.span("download", url=upstream, bytes=0) as span, \
+            context.session.get(upstream, stream=True, timeout=context.timeout) as r:
+        r.raise_for_status()
+        with open(scratch, "wb") as f:
+            for content in r.iter_content(2**20):
+                h.update(content)
+                f.write(content)
+                span["bytes"] += len(content)
+    if h.checksum(checksum_algorithm(checksum)) != checksum:
+        raise LockMismatch("%s does not match the lock file" % rel)
+    found(scratch)
 
 
 def expand_ns(namespaces, symbol):
@@ -215,7 +1582,12 @@ def expand_ns(namespaces, symbol):
         return symbol
 
 
-def add_dep(fn, upstream, set_version, install_to):
+def add_dep(fn, upstream, set_version, install_to, include=None):
+    import cwltool.load_tool
+    import ruamel.yaml
+    from cwltool.utils import visit_class
+    from schema_salad.sourceline import cmap
+
     document_loader, workflowobj, uri = cwltool.load_tool.fetch_document(fn)
     namespaces = workflowobj.get("$namespaces", cmap({}))
 
@@ -230,6 +1602,8 @@ def add_dep(fn, upstream, set_version, install_to):
             obj["version"] = set_version
         if install_to:
             obj["installTo"] = install_to
+        if include:
+            obj["include"] = include
         if isinstance(hints, list):
             for h in hints:
                 if expand_ns(namespaces, h["class"]) == CWLDEP_DEPENDENCIES_URL:
@@ -267,59 +1641,312 @@ def add_dep(fn, upstream, set_version, install_to):
     os.rename("_"+fn+"_", fn)
 
 
-def main():
+def expand_workflows(patterns):
+    """Return the workflow files named by patterns, expanding glob patterns."""
+    workflows = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            # Skip the files cwldep keeps next to each workflow.
+            matches = sorted(f for f in glob.glob(pattern, recursive=True)
+                             if os.path.isfile(f) and ".dep." not in os.path.basename(f))
+        else:
+            matches = [pattern]
+        for fn in matches:
+            if fn not in workflows:
+                workflows.append(fn)
+    return workflows
+
+
+def finish_workflow(fn, lock, locks, verified, operation, context, dry_run=False):
+    """Save the lock of the workflow fn once its dependencies are resolved.
+
+    Locked entries it no longer references are removed with 'clean' and
+    kept otherwise.  With dry_run nothing is removed or saved.
+    """
+    unref = [l for l in locks if l not in verified]
+    if operation == "clean":
+        remove_unreferenced(unref, locks, verified, context, dry_run)
+    else:
+        for l in unref:
+            logging.warn("In cwldep.lock but not referenced: %s", l)
+            verified[l] = locks[l]
+        if unref:
+            logging.warn("Use 'cwldep clean' to delete unused dependencies.")
+
+    if dry_run:
+        return
+
+    context.batch.list_places(verified)
+    lock.save(verified)
+
+    context.stat_index.save(verified)
+    context.graph.save(verified)
+
+
+def remove_unreferenced(unref, locks, verified, context, dry_run=False):
+    """Remove what the lock entries unref installed.
+
+    A path stays while an entry of verified, or of another workflow of
+    the run, installed it, a directory containing it or anything inside
+    it.  Directories are emptied on the pool's number of threads.  With
+    dry_run, the paths and the bytes they take are only reported.
+    """
+    index = PathIndex()
+    for entries in (verified, context.batch.entries):
+        for rel, entry in entries.items():
+            for path in entry.get("installed_to", [rel]):
+                index.add(path, rel)
+
+    targets = []
+    for l in unref:
+        for path in locks[l].get("installed_to", [l]):
+            kept = index.owners(path)
+            if kept:
+                logging.info("Keeping %s, used by %s", path, ", ".join(sorted(kept)))
+            targets.extend(index.removable(path))
+    targets = outermost(targets)
+
+    if dry_run:
+        total = 0
+        for path in targets:
+            size = disk_usage(path)
+            logging.info("Would remove %s (%d bytes)", path, size)
+            total += size
+        print("Would remove %d paths, reclaiming %d bytes" % (len(targets), total))
+        return
+
+    for path in targets:
+        logging.warn("Removing %s", path)
+    with context.tracer.span("clean", paths=len(targets)):
+        remove_paths(targets, installed_symlinks(context.batch.entries), context.pool.jobs)
+
+
+def report_timings(args, context):
+    if args.trace:
+        context.tracer.save(args.trace)
+    if args.stats:
+        print(context.tracer.format_summary())
+
+
+def main(argv=None):
 
     parser = argparse.ArgumentParser(
         description='Common Workflow Language dependency manager')
-    parser.add_argument("operation", type=str, choices=("install", "update", "clean", "check", "add", "search"))
-    parser.add_argument("dependencies", type=str)
-    parser.add_argument("upstream", type=str, nargs="?")
+    parser.add_argument("operation", type=str, choices=("install", "update", "clean", "check", "add", "search", "cache",
+                                                            "bundle", "graph"))
+    parser.add_argument("dependencies", type=str, nargs="+",
+                        help="Workflow files or glob patterns, resolved together in one run; "
+                        "add takes a workflow followed by the upstream to add")
     parser.add_argument("--set-version", type=str, default=None)
     parser.add_argument("--install-to", type=str, default=None)
-
-    args = parser.parse_args()
+    parser.add_argument("--include", type=str, action="append", default=None,
+                        help="Only extract archive members matching this glob pattern (may be repeated)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of dependencies to fetch in parallel")
+    parser.add_argument("--cache-dir", type=str, default=default_cache_dir(),
+                        help="Directory of the download cache shared between projects")
+    parser.add_argument("--cache-size", type=parse_size, default="5G",
+                        help="Evict least recently used downloads above this size")
+    parser.add_argument("--no-cache", action="store_true", default=False,
+                        help="Do not read or populate the download cache")
+    parser.add_argument("--http-pool-size", type=int, default=None,
+                        help="Connections kept open per host (default: max(10, jobs))")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="Retries for connection errors and 5xx responses")
+    parser.add_argument("--retry-backoff", type=float, default=0.5,
+                        help="Backoff factor in seconds between retries")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="Connect and read timeout in seconds, also after which a stalled git "
+                        "transfer is aborted")
+    parser.add_argument("--no-keep-archives", dest="keep_archives", action="store_false", default=True,
+                        help="Extract archives while downloading without keeping a copy")
+    parser.add_argument("--git-depth", type=int, default=None,
+                        help="Fetch git upstreams with this much history only")
+    parser.add_argument("--git-filter", type=str, default=None,
+                        help="Partial clone filter for git upstreams, e.g. blob:none")
+    parser.add_argument("--git-cache", type=str, default=None,
+                        help="Directory of bare repositories whose objects are shared by git checkouts")
+    parser.add_argument("--install-strategy", type=str, choices=INSTALL_STRATEGIES, default="copy",
+                        help="How a file or archive needed at several places is put at all but the "
+                        "first: copied from the first, or linked to it")
+    parser.add_argument("--paranoid", action="store_true", default=False,
+                        help="Rehash every installed file instead of trusting unchanged file metadata")
+    parser.add_argument("--frozen", action="store_true", default=False,
+                        help="Install exactly what the lock file lists without reading the workflow, "
+                        "failing if anything differs")
+    parser.add_argument("--from-bundle", type=str, default=None,
+                        help="Install from a bundle made by 'cwldep bundle' without network access")
+    parser.add_argument("--dry-run", action="store_true", default=False,
+                        help="With clean, report what would be removed and the bytes it takes "
+                        "without removing anything or changing the lock file")
+    parser.add_argument("--output", "-o", type=str, default=None,
+                        help="Bundle file to write (default: <dependencies>.dep.bundle)")
+    parser.add_argument("--lock-format", type=str, choices=("json", "sharded"), default=None,
+                        help="Write the lock as one JSON file, or as a directory of shards updated as each "
+                        "dependency is installed (default: the format in use)")
+    parser.add_argument("--hash-algorithm", type=str, choices=HASH_ALGORITHMS, default=None,
+                        help="Checksum algorithm for the lock file (default: the one it already uses, "
+                        "or %s)" % DEFAULT_HASH_ALGORITHM)
+    parser.add_argument("--low-memory", action="store_true", default=False,
+                        help="Release each workflow document once its dependencies are found and load it "
+                        "again for the final link check, so that only one workflow is in memory at a time "
+                        "when several are resolved together")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Write timings of each phase to this file in Chrome trace format")
+    parser.add_argument("--stats", action="store_true", default=False,
+                        help="Print a summary of time spent in each phase")
+
+    args = parser.parse_args(argv)
 
     if args.operation == "add":
-        add_dep(args.dependencies, args.upstream, args.set_version, args.install_to)
+        if len(args.dependencies) > 2:
+            parser.error("add takes one workflow and one upstream")
+        args.dependencies, args.upstream = args.dependencies[:1], (args.dependencies[1:] or [None])[0]
+        add_dep(args.dependencies[0], args.upstream, args.set_version, args.install_to, args.include)
 
     if args.operation == "search":
         print("WIP")
         return
 
-    document, loading_context = load_nocheck(args.dependencies)
-
-    lockfile = args.dependencies + ".dep.lock"
-    locks = {}
-    if os.path.isfile(lockfile):
-        with open(lockfile, "r") as l:
-            locks = json.load(l)
+    cache = None if args.no_cache else ObjectCache(args.cache_dir, args.cache_size)
+
+    if args.operation == "cache":
+        cache = cache or ObjectCache(args.cache_dir, args.cache_size)
+        if args.dependencies == ["stats"]:
+            st = cache.stats()
+            print("Cache directory: %s" % cache.root)
+            print("Objects: %d" % st["objects"])
+            print("Size: %d bytes (limit %d bytes)" % (st["size"], st["max_size"]))
+        elif args.dependencies == ["prune"]:
+            removed, freed = cache.prune(args.cache_size)
+            print("Removed %d objects, freed %d bytes" % (removed, freed))
+        else:
+            logging.error("Unknown cache command %s, expected 'stats' or 'prune'", " ".join(args.dependencies))
+            return 1
+        return
 
-    verified = {}
+    workflows = expand_workflows(args.dependencies)
+    if not workflows:
+        logging.error("No workflow matches %s", " ".join(args.dependencies))
+        return 1
+    if len(workflows) > 1 and (args.operation == "bundle" or args.from_bundle):
+        logging.error("bundle and --from-bundle take a single workflow")
+        return 1
+
+    jobs = max(1, args.jobs)
+    session = make_session(args.http_pool_size or max(10, jobs), args.retries, args.retry_backoff, args.timeout)
+    context = DepContext(jobs=jobs, cache=cache, session=session, timeout=args.timeout,
+                         paranoid=args.paranoid,
+                         keep_archives=args.keep_archives,
+                         git_depth=args.git_depth,
+                         git_filter=args.git_filter,
+                         git_cache=args.git_cache,
+                         install_strategy=args.install_strategy,
+                         dry_run=args.dry_run,
+                         tracer=trace.Tracer(enabled=bool(args.trace or args.stats)),
+                         frozen=args.frozen or bool(args.from_bundle),
+                         bundle=Bundle(args.from_bundle) if args.from_bundle else None)
+
+    # Each workflow keeps its own lock, stat index and graph cache, while
+    # the pool, session, caches and upstreams installed so far are shared.
+    roots = []
+    for fn in workflows:
+        lock = open_lock(fn, args.lock_format)
+        locks = lock.load()
+        if not locks and context.bundle is not None:
+            locks = context.bundle.locks
+        root = context.for_root(stat_index=StatIndex(fn + ".dep.index"),
+                                graph=GraphCache(fn + ".dep.graph"),
+                                hash_algorithm=args.hash_algorithm or lock_algorithm(locks))
+        roots.append((fn, lock, locks, {}, root))
+
+    if args.operation == "bundle":
+        fn, lock, locks, verified, root = roots[0]
+        if not locks:
+            logging.error("Nothing to bundle, %s not found", lock.path)
+            return 1
+        output = args.output or fn + ".dep.bundle"
+        try:
+            create_bundle(output, locks, root)
+        except LockMismatch as e:
+            logging.error("%s", e)
+            return 1
+        finally:
+            context.pool.shutdown()
+        logging.info("Wrote %s", output)
+        report_timings(args, context)
+        return
 
-    def do_deps(req):
-        cwl_deps(os.getcwd(), req, locks, verified, args.operation)
+    if context.frozen:
+        if args.operation != "install":
+            logging.error("--frozen and --from-bundle can only be used with install")
+            return 1
+        for fn, lock, locks, verified, root in roots:
+            if not locks:
+                logging.error("--frozen needs a lock file, %s not found", lock.path)
+                return 1
+        try:
+            for fn, lock, locks, verified, root in roots:
+                install_frozen(locks, verified, root)
+            context.pool.wait()
+        except LockMismatch as e:
+            logging.error("%s", e)
+            return 1
+        finally:
+            context.pool.shutdown()
+        for fn, lock, locks, verified, root in roots:
+            # The lock file is left as it is, unless it came from the bundle.
+            if not lock.exists():
+                lock.save(locks)
+            root.stat_index.save(verified)
+        if cache is not None and cache.stored:
+            cache.prune(cache.max_size)
+        report_timings(args, context)
+        return
 
-    visit_class(document, (CWLDEP_DEPENDENCIES_URL,), do_deps)
+    from cwltool.utils import visit_class
+
+    documents = {}
+    try:
+        for fn, lock, locks, verified, root in roots:
+            document, loading_context = load_nocheck(fn, root)
+            if args.operation != "graph" and not args.dry_run:
+                root.lock_file = lock
+            # Only the dep:Dependencies hints are kept while they are
+            # resolved, so that with --low-memory the document is released
+            # before anything is fetched.
+            requirements = []
+            visit_class(document, (CWLDEP_DEPENDENCIES_URL,), requirements.append)
+            if not args.low_memory:
+                documents[fn] = document, loading_context
+            del document, loading_context
+            for req in requirements:
+                cwl_deps(os.getcwd(), req, locks, verified, args.operation, root)
+            del requirements
+        context.pool.wait()
+    finally:
+        context.pool.shutdown()
+
+    if args.operation == "graph":
+        if len(roots) == 1:
+            print(json.dumps(roots[0][4].resolved.plan(), indent=4))
+        else:
+            print(json.dumps({fn: root.resolved.plan() for fn, lock, locks, verified, root in roots}, indent=4))
+        report_timings(args, context)
+        return
 
-    unref = False
-    for l in locks:
-        if l not in verified:
-            if args.operation == "clean":
-                for i in locks[l]["installed_to"]:
-                    logging.warn("Removing %s", i)
-                    if os.path.isfile(i):
-                        os.remove(i)
-                    else:
-                        shutil.rmtree(i)
-            else:
-                logging.warn("In cwldep.lock but not referenced: %s", l)
-                verified[l] = locks[l]
-                unref = True
+    for fn, lock, locks, verified, root in roots:
+        finish_workflow(fn, lock, locks, verified, args.operation, root, args.dry_run)
 
-    if unref:
-        logging.warn("Use 'cwldep clean' to delete unused dependencies.")
+    if cache is not None and cache.stored:
+        cache.prune(cache.max_size)
 
-    with open(lockfile, "wt") as l:
-        l.write(json.dumps(verified, indent=4, sort_keys=True))
+    for fn, lock, locks, verified, root in roots:
+        if fn in documents:
+            document, loading_context = documents.pop(fn)
+        else:
+            document, loading_context = load_nocheck(fn, root)
+        with context.tracer.span("checklinks", url=fn):
+            loading_context.loader.resolve_all(document, fn, checklinks=True)
 
-    loading_context.loader.resolve_all(document, args.dependencies, checklinks=True)
+    report_timings(args, context)
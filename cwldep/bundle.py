@@ -0,0 +1,104 @@
+"""Offline bundles of locked dependencies.
+
+A bundle is a zip file holding the lock file it was made from in
+``index.json``, the content of every locked file or archive once under
+``objects/<checksum>`` and every git commit as a git bundle under
+``git/<commit>.bundle``.  Members are compressed separately and listed
+in the zip's central directory, so installing an entry reads only its
+own member.
+"""
+from __future__ import absolute_import
+import json
+import os
+import re
+import shutil
+import uuid
+import zipfile
+
+FORMAT = 1
+INDEX = "index.json"
+
+# Archives and git bundles are already compressed.
+_STORED = (".tar.gz", ".tar.bz2", ".zip", ".bundle")
+
+
+def _name(kind, key):
+    if not re.match(r"^([0-9a-zA-Z]+:)?[0-9a-zA-Z]+$", key):
+        raise ValueError("Invalid bundle key: %s" % key)
+    if kind == "git":
+        return "git/%s.bundle" % key
+    return "objects/%s" % key.replace(":", "-")
+
+
+class BundleWriter(object):
+    """Write a bundle, which appears at path once it is closed."""
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp = "%s_%s_" % (path, uuid.uuid4().hex)
+        self.zip = zipfile.ZipFile(self._tmp, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.names = set()
+
+    def _add(self, name, src, upstream):
+        if name in self.names:
+            return
+        stored = any(upstream.endswith(s) for s in _STORED)
+        self.zip.write(src, name, zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+        self.names.add(name)
+
+    def add_object(self, checksum, src, upstream):
+        self._add(_name("objects", checksum), src, upstream)
+
+    def add_git(self, commit, src):
+        self._add(_name("git", commit), src, ".bundle")
+
+    def close(self, locks):
+        self.zip.writestr(INDEX, json.dumps({"format": FORMAT, "locks": locks}, indent=4, sort_keys=True))
+        self.zip.close()
+        os.rename(self._tmp, self.path)
+
+    def abort(self):
+        self.zip.close()
+        os.remove(self._tmp)
+
+
+class Bundle(object):
+    """Read a bundle written by BundleWriter."""
+
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path, "r")
+        index = json.loads(self.zip.read(INDEX).decode("utf-8"))
+        if index.get("format") != FORMAT:
+            raise ValueError("Unsupported bundle format %s in %s" % (index.get("format"), path))
+        self.locks = index["locks"]
+        self.names = set(self.zip.namelist())
+
+    def has_object(self, checksum):
+        return _name("objects", checksum) in self.names
+
+    def has_git(self, commit):
+        return _name("git", commit) in self.names
+
+    def _extract(self, name, tgt):
+        tmp = "%s_%s_" % (tgt, uuid.uuid4().hex)
+        with self.zip.open(name) as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, 2**20)
+        os.rename(tmp, tgt)
+
+    def extract_object(self, checksum, tgt):
+        """Write the object for checksum to tgt; return False if it is not in the bundle."""
+        if not self.has_object(checksum):
+            return False
+        self._extract(_name("objects", checksum), tgt)
+        return True
+
+    def extract_git(self, commit, tgt):
+        """Write the git bundle of commit to tgt; return False if it is not in the bundle."""
+        if not self.has_git(commit):
+            return False
+        self._extract(_name("git", commit), tgt)
+        return True
+
+    def close(self):
+        self.zip.close()
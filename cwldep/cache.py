@@ -0,0 +1,205 @@
+"""Content-addressed store of downloaded dependency files.
+
+Objects live under ``<root>/objects/<xx>/<checksum>`` next to a small
+``.json`` record listing the upstream URLs they were fetched from.  The
+modification time of that record is the last time the object was used
+and drives least-recently-used eviction.
+"""
+from __future__ import absolute_import
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_SIZE_SUFFIXES = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "cwldep")
+
+
+def parse_size(text):
+    """Parse a size such as '512M' or '10G' into bytes."""
+    m = re.match(r"^\s*(\d+)\s*([KMGT]?)i?B?\s*$", text, re.IGNORECASE)
+    if not m:
+        raise ValueError("Invalid size: %s" % text)
+    return int(m.group(1)) * _SIZE_SUFFIXES[m.group(2).upper()]
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+INSTALL_STRATEGIES = ("copy", "hardlink", "reflink", "symlink")
+
+# ioctl request cloning a whole file on Linux (btrfs, xfs, ...).
+_FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+
+
+def install_file(src, dst, strategy="copy"):
+    """Put the content of src at dst as a copy, hardlink, reflink or
+    relative symlink, copying when the link is not possible.
+
+    The new file appears at dst atomically.
+    """
+    tmp = "%s_%s_" % (dst, uuid.uuid4().hex)
+    try:
+        if strategy == "hardlink":
+            os.link(src, tmp)
+        elif strategy == "symlink":
+            os.symlink(os.path.relpath(os.path.abspath(src), os.path.dirname(os.path.abspath(dst))), tmp)
+        elif strategy == "reflink":
+            _reflink(src, tmp)
+        else:
+            shutil.copy2(src, tmp)
+    except OSError:
+        if strategy == "copy":
+            raise
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        shutil.copy2(src, tmp)
+    os.rename(tmp, dst)
+
+
+def link_or_copy(src, dst):
+    """Hardlink src to dst, copying when a link is not possible.
+
+    The new file appears at dst atomically.
+    """
+    install_file(src, dst, "hardlink")
+
+
+class ObjectCache(object):
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.objects = os.path.join(root, "objects")
+        self.max_size = max_size
+        # Bytes of the objects added by this process, so that a run that
+        # added none does not need to prune.
+        self.stored = 0
+        self._lock = threading.Lock()
+
+    def path(self, checksum):
+        # Checksums other than sha1 are "algorithm:hexdigest"; the colon
+        # is not portable in file names.
+        if not re.match(r"^([0-9a-zA-Z]+:)?[0-9a-zA-Z]+$", checksum):
+            raise ValueError("Invalid checksum: %s" % checksum)
+        digest = checksum.split(":")[-1]
+        return os.path.join(self.objects, digest[:2], checksum.replace(":", "-"))
+
+    def _upstreams(self, checksum):
+        try:
+            with open(self.path(checksum) + ".json", "r") as f:
+                return json.load(f)["upstream"]
+        except (IOError, OSError, ValueError, KeyError):
+            return []
+
+    def lookup(self, checksum, upstream):
+        """Return the path of the object for checksum fetched from upstream, if any."""
+        obj = self.path(checksum)
+        if upstream not in self._upstreams(checksum) or not os.path.isfile(obj):
+            return None
+        os.utime(obj + ".json", None)
+        return obj
+
+    def fetch(self, checksum, upstream, tgt):
+        """Install the object for checksum at tgt.
+
+        Returns False when the cache has no object with that checksum
+        fetched from upstream.
+        """
+        obj = self.lookup(checksum, upstream)
+        if obj is None:
+            return False
+        link_or_copy(obj, tgt)
+        return True
+
+    def store(self, src, checksum, upstream):
+        obj = self.path(checksum)
+        _makedirs(os.path.dirname(obj))
+        if not os.path.isfile(obj):
+            link_or_copy(src, obj)
+            with self._lock:
+                self.stored += os.path.getsize(obj)
+        upstreams = self._upstreams(checksum)
+        if upstream not in upstreams:
+            upstreams.append(upstream)
+        tmp = "%s_%s_" % (obj, uuid.uuid4().hex)
+        with open(tmp, "w") as f:
+            json.dump({"upstream": upstreams}, f)
+        os.rename(tmp, obj + ".json")
+
+    def discard(self, checksum):
+        obj = self.path(checksum)
+        for p in (obj, obj + ".json"):
+            if os.path.isfile(p):
+                os.remove(p)
+
+    def entries(self):
+        """Yield (checksum, size, last_used) for every cached object."""
+        if not os.path.isdir(self.objects):
+            return
+        for prefix in os.listdir(self.objects):
+            d = os.path.join(self.objects, prefix)
+            if not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                if name.endswith(".json") or name.endswith("_"):
+                    continue
+                p = os.path.join(d, name)
+                try:
+                    size = os.stat(p).st_size
+                except OSError:
+                    continue
+                try:
+                    last_used = os.stat(p + ".json").st_mtime
+                except OSError:
+                    last_used = 0
+                yield name.replace("-", ":"), size, last_used
+
+    def stats(self):
+        count = 0
+        size = 0
+        for _, s, _ in self.entries():
+            count += 1
+            size += s
+        return {"objects": count, "size": size, "max_size": self.max_size}
+
+    def prune(self, max_size):
+        """Evict least recently used objects until the cache fits in max_size.
+
+        Returns the number of objects removed and the bytes freed.
+        """
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        removed = 0
+        freed = 0
+        for checksum, size, _ in entries:
+            if total <= max_size:
+                break
+            logging.info("Evicting %s from cache", checksum)
+            self.discard(checksum)
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
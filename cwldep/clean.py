@@ -0,0 +1,142 @@
+"""Removing what unreferenced dependencies installed.
+
+The paths installed by the lock entries that are still referenced are
+indexed in a trie, so that a path is only removed when no referenced
+entry installed it, a directory containing it or anything inside it.
+Around paths that are kept, the rest of a tree is still removed.
+"""
+from __future__ import absolute_import
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from .cache import install_file
+
+
+def _parts(path):
+    return [p for p in os.path.normpath(path).split(os.sep) if p not in ("", ".")]
+
+
+class PathIndex(object):
+    """A trie of installed paths and the lock entries that installed them."""
+
+    def __init__(self):
+        self.root = self._new()
+
+    @staticmethod
+    def _new():
+        # count is the number of (path, owner) pairs at or below the node.
+        return {"children": {}, "owners": set(), "count": 0}
+
+    def add(self, path, owner):
+        node = self.root
+        nodes = [node]
+        for part in _parts(path):
+            node = node["children"].setdefault(part, self._new())
+            nodes.append(node)
+        if owner in node["owners"]:
+            return
+        node["owners"].add(owner)
+        for n in nodes:
+            n["count"] += 1
+
+    def owners(self, path):
+        """Return the owners of path or of a directory containing it."""
+        owners = set()
+        node = self.root
+        for part in _parts(path):
+            node = node["children"].get(part)
+            if node is None:
+                break
+            owners.update(node["owners"])
+        return owners
+
+    def _holds_below(self, path):
+        node = self.root
+        for part in _parts(path):
+            node = node["children"].get(part)
+            if node is None:
+                return False
+        return node["count"] > len(node["owners"])
+
+    def removable(self, path):
+        """Return what to remove of path so that every indexed path stays."""
+        if not os.path.lexists(path) or self.owners(path):
+            return []
+        if not self._holds_below(path) or os.path.islink(path) or not os.path.isdir(path):
+            return [path]
+        removable = []
+        for name in sorted(os.listdir(path)):
+            removable.extend(self.removable(os.path.join(path, name)))
+        return removable
+
+
+def outermost(paths):
+    """Return paths without duplicates and without those inside another of them."""
+    result = []
+    for path in sorted(set(os.path.normpath(p) for p in paths), key=_parts):
+        if not result or _parts(path)[:len(_parts(result[-1]))] != _parts(result[-1]):
+            result.append(path)
+    return result
+
+
+def disk_usage(path):
+    """Return the bytes taken by the files at or below path."""
+    if os.path.islink(path) or not os.path.isdir(path):
+        return os.lstat(path).st_size
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            total += os.lstat(os.path.join(dirpath, name)).st_size
+    return total
+
+
+def installed_symlinks(entries):
+    """Map the real path of each file that installed paths in entries
+    symlink to onto those paths."""
+    links = {}
+    for rel in entries:
+        if os.path.islink(rel):
+            links.setdefault(os.path.realpath(rel), []).append(rel)
+    for paths in links.values():
+        paths.sort()
+    return links
+
+
+def remove_installed(path, links):
+    """Remove the installed path.
+
+    A file that other installed paths are symlinks to is moved to the
+    first of them instead, and the rest are pointed at its new place.
+    """
+    if os.path.islink(path) or os.path.isfile(path):
+        others = links.pop(os.path.realpath(path), None) if not os.path.islink(path) else None
+        if others:
+            os.rename(path, others[0])
+            for other in others[1:]:
+                install_file(others[0], other, "symlink")
+            links[os.path.realpath(others[0])] = others[1:]
+        else:
+            os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def remove_paths(paths, links, jobs=1):
+    """Remove paths, the contents of each directory on jobs threads."""
+    dirs = []
+    tasks = []
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            dirs.append(path)
+            tasks.extend(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            tasks.append(path)
+    if jobs > 1 and len(tasks) > 1:
+        with ThreadPoolExecutor(jobs) as executor:
+            for _ in executor.map(lambda p: remove_installed(p, links), tasks):
+                pass
+    else:
+        for path in tasks:
+            remove_installed(path, links)
+    for path in dirs:
+        os.rmdir(path)
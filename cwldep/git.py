@@ -0,0 +1,214 @@
+"""Fetching and checking out git upstreams.
+
+Checkouts fetch only the commit they need: a locked commit is fetched
+directly by its SHA, optionally as a shallow (--depth) or partial
+(--filter) fetch.  Several checkouts of the same upstream can share one
+bare repository of objects through git alternates.  Checking whether
+an upstream moved only reads the refs it advertises.
+"""
+from __future__ import absolute_import
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import threading
+from . import trace
+
+_repo_locks = {}
+_repo_locks_lock = threading.Lock()
+
+
+def run_git(args, cwd=None, stderr=None, tracer=trace.NULL, timeout=None):
+    """Run git with args and return its output.
+
+    With timeout, an HTTP transfer that stalls for that many seconds is
+    aborted.
+    """
+    if timeout:
+        args = ["-c", "http.lowSpeedLimit=1", "-c", "http.lowSpeedTime=%d" % max(1, int(timeout))] + args
+    n = 0
+    while args[n] == "-c":
+        n += 2
+    command = args[n]
+    with tracer.span("git " + command, cwd=cwd or os.getcwd(), args=" ".join(args)):
+        return subprocess.check_output(["git"] + args, cwd=cwd, stderr=stderr).decode("utf-8").strip()
+
+
+def is_commit(ref):
+    return bool(ref) and re.match(r"^[0-9a-f]{40}$", ref) is not None
+
+
+def _git_dir(repo):
+    git_dir = os.path.join(repo, ".git")
+    return git_dir if os.path.isdir(git_dir) else repo
+
+
+def is_repository(path):
+    """Return True if path is a git repository, with a work tree or bare."""
+    return os.path.isdir(os.path.join(path, ".git")) or (
+        os.path.isfile(os.path.join(path, "HEAD")) and os.path.isdir(os.path.join(path, "objects")))
+
+
+def head_commit(tgt, tracer=trace.NULL):
+    """Return the commit checked out at tgt, or None if there is none.
+
+    Checkouts made by cwldep have a detached HEAD, which is read from
+    .git/HEAD without starting git.
+    """
+    try:
+        with open(os.path.join(tgt, ".git", "HEAD"), "r") as f:
+            head = f.read().strip()
+    except (IOError, OSError):
+        return None
+    if is_commit(head):
+        return head
+    try:
+        return run_git(["rev-parse", "--verify", "--quiet", "HEAD^{commit}"], cwd=tgt, tracer=tracer)
+    except subprocess.CalledProcessError:
+        return None
+
+
+def is_checked_out(tgt, commit, tracer=trace.NULL):
+    """Return True if the git checkout at tgt is at the full commit id commit."""
+    return is_commit(commit) and head_commit(tgt, tracer) == commit
+
+
+def ls_remote(upstream, tracer=trace.NULL, timeout=None):
+    """Return the refs upstream advertises, as a dict of ref name to commit."""
+    refs = {}
+    for line in run_git(["ls-remote", upstream], stderr=subprocess.DEVNULL, tracer=tracer,
+                        timeout=timeout).splitlines():
+        sha, _, name = line.partition("\t")
+        refs[name] = sha
+    return refs
+
+
+def parse_advertisement(data):
+    """Return the refs in a smart HTTP info/refs response, like ls_remote()."""
+    refs = {}
+    pos = 0
+    while pos + 4 <= len(data):
+        size = int(data[pos:pos + 4], 16)
+        if size == 0:
+            # A flush packet separates the service line from the refs.
+            pos += 4
+            continue
+        line = data[pos + 4:pos + size].split(b"\0")[0].rstrip(b"\n").decode("utf-8")
+        pos += size
+        if line.startswith("#"):
+            continue
+        sha, _, name = line.partition(" ")
+        refs[name] = sha
+    return refs
+
+
+def resolve_ref(refs, ref):
+    """Return the commit of ref among refs, or None if it is not advertised.
+
+    Annotated tags resolve to the commit they point to.  A full commit
+    id is returned as it is, as servers do not advertise commits.
+    """
+    if is_commit(ref):
+        return ref
+    for name in (ref, "refs/tags/" + ref, "refs/heads/" + ref):
+        if name + "^{}" in refs:
+            return refs[name + "^{}"]
+        if name in refs:
+            return refs[name]
+    return None
+
+
+def _repo_lock(path):
+    with _repo_locks_lock:
+        return _repo_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def shared_repo(upstream, cache_dir, tracer=trace.NULL):
+    """Return the bare repository holding the objects of upstream in cache_dir."""
+    path = os.path.join(cache_dir, hashlib.sha1(upstream.encode("utf-8")).hexdigest() + ".git")
+    if not os.path.isdir(path):
+        run_git(["init", "--quiet", "--bare", path], tracer=tracer)
+    return path
+
+
+def _fetch(repo, remote, ref, depth=None, filter_spec=None, tracer=trace.NULL, timeout=None):
+    """Fetch ref from remote into repo and return a revision naming it there."""
+    args = ["fetch", "--quiet", "--no-tags"]
+    if depth:
+        args.append("--depth=%d" % depth)
+    if filter_spec:
+        args.append("--filter=%s" % filter_spec)
+    try:
+        run_git(args + [remote, ref], cwd=repo, stderr=subprocess.DEVNULL, tracer=tracer, timeout=timeout)
+        return "FETCH_HEAD^{commit}"
+    except subprocess.CalledProcessError:
+        # Servers only hand out advertised refs and full commit ids, so
+        # abbreviated commits need the branches and tags fetched first.
+        logging.info("Fetching all branches of %s", remote)
+        args = ["fetch", "--quiet", "--tags", "--update-head-ok"]
+        if os.path.isfile(os.path.join(_git_dir(repo), "shallow")):
+            args.append("--unshallow")
+        run_git(args + [remote, "+refs/heads/*:refs/heads/*"], cwd=repo, tracer=tracer, timeout=timeout)
+        return ref + "^{commit}"
+
+
+def fetch(repo, remote, ref, depth=None, filter_spec=None, tracer=trace.NULL, timeout=None):
+    """Fetch ref from remote into repo and return the fetched commit."""
+    rev = _fetch(repo, remote, ref, depth, filter_spec, tracer, timeout)
+    return run_git(["rev-parse", rev], cwd=repo, tracer=tracer)
+
+
+def checkout(upstream, tgt, ref, depth=None, filter_spec=None, cache_dir=None, source=None,
+             tracer=trace.NULL, timeout=None):
+    """Check out ref of upstream at tgt and return the commit checked out.
+
+    ref may be a branch, a tag or a commit.  When it is a full commit id
+    that is already checked out nothing is fetched and git is not run.  With cache_dir,
+    objects are fetched into a bare repository shared by every checkout
+    of upstream and tgt borrows them through its alternates file.
+    source, such as a git bundle, is fetched from instead of upstream.
+    Fetches that stall for timeout seconds are aborted.
+    """
+    if os.path.isdir(os.path.join(tgt, ".git")):
+        if is_checked_out(tgt, ref, tracer):
+            return ref
+    else:
+        run_git(["init", "--quiet", tgt], tracer=tracer)
+        run_git(["remote", "add", "origin", upstream], cwd=tgt, tracer=tracer)
+
+    remote = source or "origin"
+    if source is not None:
+        # Bundles hold complete history and cannot be filtered.
+        filter_spec = None
+    if cache_dir is not None:
+        # Partial clones need their promisor remote configured, so the
+        # shared repository always fetches complete commits.
+        bare = shared_repo(upstream, cache_dir, tracer)
+        with _repo_lock(bare):
+            ref = fetch(bare, source or upstream, ref, depth, tracer=tracer, timeout=timeout)
+            # Keep the commit reachable so gc in the shared repository
+            # does not drop objects a checkout relies on.
+            run_git(["update-ref", "refs/cwldep/" + ref, ref], cwd=bare, tracer=tracer)
+        alternates = os.path.join(tgt, ".git", "objects", "info", "alternates")
+        objects = os.path.abspath(os.path.join(bare, "objects"))
+        if not os.path.isfile(alternates):
+            with open(alternates, "w") as f:
+                f.write(objects + "\n")
+        remote = os.path.abspath(bare)
+        filter_spec = None
+
+    # Checking out the fetched revision resolves it too, so the commit is
+    # then read from HEAD.
+    rev = _fetch(tgt, remote, ref, depth, filter_spec, tracer, timeout)
+    run_git(["-c", "advice.detachedHead=false", "checkout", "--quiet", "--detach", rev], cwd=tgt,
+            tracer=tracer)
+    return head_commit(tgt, tracer)
+
+
+def bundle(repo, commit, path, tracer=trace.NULL):
+    """Write commit and its history in repo to the git bundle at path."""
+    # A bundle only takes refs, so the commit gets one.
+    run_git(["update-ref", "refs/cwldep/" + commit, commit], cwd=repo, tracer=tracer)
+    run_git(["bundle", "create", path, "refs/cwldep/" + commit], cwd=repo,
+            stderr=subprocess.DEVNULL, tracer=tracer)
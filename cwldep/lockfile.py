@@ -0,0 +1,241 @@
+"""Lock file formats.
+
+The default lock is one JSON file, ``<workflow>.dep.lock``, written in
+full at the end of a run.  The sharded lock is a directory,
+``<workflow>.dep.lock.d``, of JSON-lines files that each hold the entries
+of the installed paths hashing to that shard.  Every entry is appended
+to its shard as soon as it is resolved, so an interrupted run keeps
+what it installed, and the shards are compacted when the run finishes.
+Writers take an exclusive lock on each shard they touch, so several
+runs in one workspace do not interleave their writes.
+"""
+from __future__ import absolute_import
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SHARD_SUFFIX = ".jsonl"
+
+
+def write_atomic(path, text):
+    """Replace path with text, through a temporary file of its own."""
+    tmp = "%s_%s_" % (path, uuid.uuid4().hex)
+    with open(tmp, "wt") as f:
+        f.write(text)
+    os.rename(tmp, path)
+
+
+class _Locked(object):
+    """An open file holding an exclusive lock for the duration of a with block.
+
+    If the file was replaced while waiting for the lock, the new file is
+    opened and locked instead.
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.f = None
+
+    def __enter__(self):
+        while True:
+            self.f = open(self.path, self.mode)
+            if fcntl is None:
+                return self.f
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self.f.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return self.f
+            except OSError:
+                pass
+            self.f.close()
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+
+class JsonLock(object):
+    """The whole lock in one JSON file.
+
+    While the file does not exist, load() reads the previous lock, which
+    is removed once this one is saved.
+    """
+
+    def __init__(self, path, previous=None):
+        self.path = path
+        self.previous = previous
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        if not self.exists():
+            return self.previous.load() if self.previous is not None else {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def get(self, rel):
+        return self.load().get(rel)
+
+    def record(self, rel, entry):
+        pass
+
+    def save(self, entries):
+        write_atomic(self.path, json.dumps(entries, indent=4, sort_keys=True))
+        if self.previous is not None:
+            self.previous.remove()
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.path)
+
+
+class ShardedLock(object):
+    """The lock as a directory of JSON-lines shards.
+
+    Each line is {"path": rel, "entry": entry}; the last line for a path
+    wins and a null entry removes it.  A line cut short by a crash is
+    ignored.  While the directory does not exist, load() reads the
+    previous lock, which is removed once this one is saved.
+    """
+
+    def __init__(self, path, previous=None, shards=256):
+        self.path = path
+        self.previous = previous
+        self.shards = shards
+        self.entries = {}
+        self.dirty = set()
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def shard(self, rel):
+        n = int(hashlib.sha1(rel.encode("utf-8")).hexdigest()[:8], 16) % self.shards
+        return os.path.join(self.path, "%02x%s" % (n, SHARD_SUFFIX))
+
+    @staticmethod
+    def _read(shard, entries):
+        """Read shard into entries; return the number of lines it has."""
+        lines = 0
+        try:
+            f = open(shard, "r")
+        except (IOError, OSError):
+            return lines
+        with f:
+            for line in f:
+                lines += 1
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    logging.warn("Ignoring incomplete line in %s", shard)
+                    continue
+                if e["entry"] is None:
+                    entries.pop(e["path"], None)
+                else:
+                    entries[e["path"]] = e["entry"]
+        return lines
+
+    def load(self):
+        if not self.exists():
+            # Entries of the previous lock are all appended as they are
+            # recorded, as none of them are in a shard yet.
+            return self.previous.load() if self.previous is not None else {}
+        entries = {}
+        dirty = set()
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(SHARD_SUFFIX):
+                shard = os.path.join(self.path, name)
+                found = {}
+                if self._read(shard, found) != len(found):
+                    # Appended to since it was last compacted.
+                    dirty.add(shard)
+                entries.update(found)
+        with self._lock:
+            self.entries = dict(entries)
+            self.dirty = dirty
+        return entries
+
+    def get(self, rel):
+        """Return the entry for rel, reading only its shard."""
+        entries = {}
+        self._read(self.shard(rel), entries)
+        return entries.get(rel)
+
+    def record(self, rel, entry):
+        """Append entry for rel unless it is already what the lock holds."""
+        with self._lock:
+            if self.entries.get(rel) == entry:
+                return
+            self.entries[rel] = entry
+            self.dirty.add(self.shard(rel))
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                if not os.path.isdir(self.path):
+                    raise
+        with _Locked(self.shard(rel), "a") as f:
+            f.write(json.dumps({"path": rel, "entry": entry}, sort_keys=True) + "\n")
+
+    def save(self, entries):
+        """Compact the shards so that the lock holds entries.
+
+        Only shards that were appended to, or whose entries differ from
+        entries, are rewritten.  Paths that another run appended to a
+        shard since this one loaded it, and that this run neither loaded
+        nor recorded, are kept.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        by_shard = {}
+        for rel, entry in entries.items():
+            by_shard.setdefault(self.shard(rel), {})[rel] = entry
+        with self._lock:
+            known = dict(self.entries)
+            shards = set(self.dirty)
+        shards.update(self.shard(rel) for rel in set(entries) | set(known) if entries.get(rel) != known.get(rel))
+        saved = dict(entries)
+        for shard in sorted(shards):
+            with _Locked(shard, "a"):
+                found = {}
+                self._read(shard, found)
+                keep = {rel: e for rel, e in found.items() if rel not in known}
+                keep.update(by_shard.get(shard, {}))
+                saved.update(keep)
+                if keep:
+                    write_atomic(shard, "".join(
+                        json.dumps({"path": rel, "entry": keep[rel]}, sort_keys=True) + "\n"
+                        for rel in sorted(keep)))
+                else:
+                    os.remove(shard)
+        with self._lock:
+            self.entries = saved
+            self.dirty = set()
+        if self.previous is not None:
+            self.previous.remove()
+
+    def remove(self):
+        if self.exists():
+            shutil.rmtree(self.path)
+
+
+def open_lock(base, lock_format=None):
+    """Return the lock of the workflow base.
+
+    Without lock_format, the sharded lock is used if it exists.  Until
+    the chosen lock is first saved, the lock in the other format is read
+    instead, so switching formats keeps the locked entries.
+    """
+    if lock_format == "sharded" or (lock_format is None and os.path.isdir(base + ".dep.lock.d")):
+        return ShardedLock(base + ".dep.lock.d", JsonLock(base + ".dep.lock"))
+    return JsonLock(base + ".dep.lock", ShardedLock(base + ".dep.lock.d"))
@@ -0,0 +1,115 @@
+"""Timing of the phases of a cwldep run.
+
+A Tracer records spans: named, timed sections of work with a few
+arguments such as the upstream URL, the bytes transferred or whether a
+cache was hit.  Spans can be written in the Chrome trace event format
+(load them in chrome://tracing or Perfetto) or summarized as a table.
+"""
+from __future__ import absolute_import, division
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+
+
+class Tracer(object):
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.spans = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """Time the enclosed block.
+
+        Yields the dict of span arguments so that the block can add to
+        them, e.g. the number of bytes it transferred.
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.spans.append((name, start - self._start, end - start,
+                                   threading.current_thread().ident, args))
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        with self._lock:
+            spans = list(self.spans)
+        for name, start, duration, tid, args in spans:
+            events.append({
+                "name": name,
+                "cat": "cwldep",
+                "ph": "X",
+                "ts": int(start * 1e6),
+                "dur": int(duration * 1e6),
+                "pid": pid,
+                "tid": tid,
+                "args": args
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        tmp = "%s_%s_" % (path, uuid.uuid4().hex)
+        with open(tmp, "wt") as f:
+            json.dump(self.chrome_trace(), f)
+        os.rename(tmp, path)
+
+    def summary(self):
+        """Aggregate spans by name.
+
+        Returns a dict of name to count, total and max seconds, bytes,
+        and cache hits and misses.
+        """
+        phases = {}
+        with self._lock:
+            spans = list(self.spans)
+        for name, _, duration, _, args in spans:
+            p = phases.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                         "bytes": 0, "hits": 0, "misses": 0})
+            p["count"] += 1
+            p["seconds"] += duration
+            p["max_seconds"] = max(p["max_seconds"], duration)
+            p["bytes"] += args.get("bytes", 0)
+            if "cache" in args:
+                p["hits" if args["cache"] == "hit" else "misses"] += 1
+        return phases
+
+    def slowest(self, limit=10):
+        """Return (url, seconds) for the upstreams that took longest in total."""
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for _, _, duration, _, args in spans:
+            if "url" in args:
+                totals[args["url"]] = totals.get(args["url"], 0.0) + duration
+        return sorted(totals.items(), key=lambda t: -t[1])[:limit]
+
+    def format_summary(self):
+        lines = ["%-18s %7s %10s %10s %12s %6s %6s" % (
+            "phase", "count", "total s", "max s", "bytes", "hits", "misses")]
+        for name, p in sorted(self.summary().items(), key=lambda t: -t[1]["seconds"]):
+            lines.append("%-18s %7d %10.3f %10.3f %12d %6d %6d" % (
+                name, p["count"], p["seconds"], p["max_seconds"], p["bytes"], p["hits"], p["misses"]))
+        slowest = self.slowest()
+        if slowest:
+            lines.append("")
+            lines.append("Slowest upstreams:")
+            for url, seconds in slowest:
+                lines.append("%10.3f  %s" % (seconds, url))
+        return "\n".join(lines)
+
+
+NULL = Tracer(enabled=False)
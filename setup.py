@@ -20,12 +20,13 @@ setup(name='cwldep',
       license='Apache 2.0',
       packages=["cwldep"],
       include_package_data=True,
-      install_requires=['cwltool', 'python-dateutil'],
+      install_requires=['cwltool', 'python-dateutil', 'requests', 'urllib3'],
+      extras_require={'fast': ['xxhash']},
       test_suite='tests',
       entry_points={
           'console_scripts': ["cwldep=cwldep:main"]
       },
       tests_require=['mock >= 2.0.0',],
       zip_safe=True,
-      python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, <4'
+      python_requires='>=3.9, <4'
 )
@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from cwldep.bundle import Bundle, BundleWriter
+
+
+class BundleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "main.cwl.dep.bundle")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _file(self, name, content):
+        p = os.path.join(self.tmp, name)
+        with open(p, "w") as f:
+            f.write(content)
+        return p
+
+    def test_write_and_read(self):
+        locks = {"a.cwl": {"checksum": "sha256:00myhash123", "upstream": "http://example.com/a.cwl"}}
+        writer = BundleWriter(self.path)
+        writer.add_object("sha256:00myhash123", self._file("a.cwl", "cwlVersion: v1.0"),
+                          "http://example.com/a.cwl")
+        writer.add_object("77otherhash890", self._file("b.tar.gz", "archive"), "http://example.com/b.tar.gz")
+        writer.add_git("0123abcd", self._file("repo.bundle", "bundle"))
+        writer.close(locks)
+
+        with zipfile.ZipFile(self.path) as z:
+            types = {i.filename: i.compress_type for i in z.infolist()}
+        self.assertEqual(types["objects/sha256-00myhash123"], zipfile.ZIP_DEFLATED)
+        self.assertEqual(types["objects/77otherhash890"], zipfile.ZIP_STORED)
+
+        bundle = Bundle(self.path)
+        self.assertEqual(bundle.locks, locks)
+        tgt = os.path.join(self.tmp, "out.cwl")
+        self.assertTrue(bundle.extract_object("sha256:00myhash123", tgt))
+        with open(tgt) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.0")
+        self.assertFalse(bundle.extract_object("00missing", tgt))
+        self.assertTrue(bundle.has_git("0123abcd"))
+        bundle.close()
+
+    def test_abort(self):
+        writer = BundleWriter(self.path)
+        writer.abort()
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_invalid_key(self):
+        writer = BundleWriter(self.path)
+        with self.assertRaises(ValueError):
+            writer.add_object("../../etc/passwd", self._file("a.cwl", ""), "http://example.com/a.cwl")
+        writer.abort()
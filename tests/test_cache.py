@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+from cwldep.cache import ObjectCache, install_file, parse_size
+
+
+class ObjectCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = ObjectCache(os.path.join(self.tmp, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _file(self, name, content):
+        p = os.path.join(self.tmp, name)
+        with open(p, "w") as f:
+            f.write(content)
+        return p
+
+    def test_store_and_fetch(self):
+        src = self._file("a.cwl", "cwlVersion: v1.0")
+        self.cache.store(src, "00myhash123", "http://example.com/a.cwl")
+        tgt = os.path.join(self.tmp, "b.cwl")
+        self.assertTrue(self.cache.fetch("00myhash123", "http://example.com/a.cwl", tgt))
+        with open(tgt) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.0")
+
+    def test_store_counts_added_bytes(self):
+        src = self._file("a.cwl", "cwlVersion: v1.0")
+        self.assertEqual(self.cache.stored, 0)
+        self.cache.store(src, "00myhash123", "http://example.com/a.cwl")
+        self.cache.store(src, "00myhash123", "http://example.com/b.cwl")
+        self.assertEqual(self.cache.stored, len("cwlVersion: v1.0"))
+
+    def test_fetch_other_upstream(self):
+        src = self._file("a.cwl", "cwlVersion: v1.0")
+        self.cache.store(src, "00myhash123", "http://example.com/a.cwl")
+        tgt = os.path.join(self.tmp, "b.cwl")
+        self.assertFalse(self.cache.fetch("00myhash123", "http://example.com/other.cwl", tgt))
+        self.assertFalse(self.cache.fetch("77otherhash890", "http://example.com/a.cwl", tgt))
+        self.assertFalse(os.path.exists(tgt))
+
+    def test_prune_evicts_least_recently_used(self):
+        for n, checksum in enumerate(("aa11", "bb22", "cc33")):
+            src = self._file(checksum, "x" * 10)
+            self.cache.store(src, checksum, "http://example.com/%s" % checksum)
+            os.utime(self.cache.path(checksum) + ".json", (n, n))
+        self.assertEqual(self.cache.prune(20), (1, 10))
+        self.assertEqual(sorted(e[0] for e in self.cache.entries()), ["bb22", "cc33"])
+        self.assertEqual(self.cache.stats()["size"], 20)
+
+    def test_algorithm_prefixed_checksum(self):
+        src = self._file("a.cwl", "cwlVersion: v1.0")
+        self.cache.store(src, "sha256:00myhash123", "http://example.com/a.cwl")
+        self.assertNotIn(":", self.cache.path("sha256:00myhash123"))
+        self.assertEqual([e[0] for e in self.cache.entries()], ["sha256:00myhash123"])
+        tgt = os.path.join(self.tmp, "b.cwl")
+        self.assertTrue(self.cache.fetch("sha256:00myhash123", "http://example.com/a.cwl", tgt))
+
+    def test_invalid_checksum(self):
+        with self.assertRaises(ValueError):
+            self.cache.path("../../etc/passwd")
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("512"), 512)
+        self.assertEqual(parse_size("10K"), 10240)
+        self.assertEqual(parse_size("5G"), 5 * 2**30)
+        with self.assertRaises(ValueError):
+            parse_size("lots")
+
+    def test_install_file_strategies(self):
+        src = self._file("a.cwl", "cwlVersion: v1.0")
+        d = os.path.join(self.tmp, "sub")
+        os.mkdir(d)
+        for strategy in ("copy", "hardlink", "reflink", "symlink"):
+            tgt = os.path.join(d, strategy + ".cwl")
+            install_file(src, tgt, strategy)
+            with open(tgt) as f:
+                self.assertEqual(f.read(), "cwlVersion: v1.0")
+            self.assertEqual(os.path.samefile(src, tgt), strategy in ("hardlink", "symlink"))
+        self.assertEqual(os.readlink(os.path.join(d, "symlink.cwl")), os.path.join("..", "a.cwl"))
+        self.assertEqual(sorted(os.listdir(d)), ["copy.cwl", "hardlink.cwl", "reflink.cwl", "symlink.cwl"])
@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+from cwldep import clean
+
+
+class CleanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _file(self, name, content="cwlVersion: v1.0"):
+        p = os.path.join(self.tmp, name)
+        if not os.path.isdir(os.path.dirname(p)):
+            os.makedirs(os.path.dirname(p))
+        with open(p, "w") as f:
+            f.write(content)
+        return p
+
+    def test_path_index(self):
+        tree = os.path.join(self.tmp, "archive")
+        kept = self._file("archive/tools/kept.cwl")
+        gone = self._file("archive/tools/gone.cwl")
+        other = self._file("archive/other.cwl")
+        index = clean.PathIndex()
+        index.add(kept, "kept.cwl")
+        index.add(os.path.join(self.tmp, "shared"), "a.tar.gz")
+        index.add(os.path.join(self.tmp, "shared"), "b.tar.gz")
+        self.assertEqual(index.owners(os.path.join(self.tmp, "shared", "x.cwl")), {"a.tar.gz", "b.tar.gz"})
+        self.assertEqual(index.owners(tree), set())
+        self.assertEqual(index.removable(tree), [other, gone])
+        self.assertEqual(index.removable(kept), [])
+        self.assertEqual(index.removable(os.path.join(self.tmp, "missing")), [])
+
+    def test_outermost(self):
+        self.assertEqual(clean.outermost(["a/b", "a", "ab", "a/b/c", "ab"]), ["a", "ab"])
+
+    def test_disk_usage(self):
+        self._file("tree/a.cwl", "abc")
+        self._file("tree/sub/b.cwl", "de")
+        self.assertEqual(clean.disk_usage(os.path.join(self.tmp, "tree")), 5)
+        self.assertEqual(clean.disk_usage(os.path.join(self.tmp, "tree", "a.cwl")), 3)
+
+    def test_remove_paths(self):
+        for n in range(10):
+            self._file("tree/d%d/f.cwl" % n)
+        single = self._file("single.cwl")
+        clean.remove_paths([os.path.join(self.tmp, "tree"), single], {}, jobs=4)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_remove_installed_keeps_symlinked_content(self):
+        first = self._file("first.cwl")
+        others = [os.path.join(self.tmp, d + ".cwl") for d in ("second", "third")]
+        for other in others:
+            os.symlink("first.cwl", other)
+        links = clean.installed_symlinks(others)
+        clean.remove_installed(first, links)
+        self.assertFalse(os.path.lexists(first))
+        self.assertFalse(os.path.islink(others[0]))
+        self.assertEqual(os.readlink(others[1]), "second.cwl")
+        clean.remove_installed(others[1], links)
+        self.assertFalse(os.path.lexists(others[1]))
+        clean.remove_installed(others[1], links)
@@ -1,7 +1,14 @@
 from __future__ import absolute_import
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
 import unittest
+import zipfile
 import cwldep
-from mock import patch, Mock, mock_open, call
+from mock import patch, Mock, MagicMock, mock_open, call, ANY
 
 
 class DownloadTestCase(unittest.TestCase):
@@ -17,7 +24,7 @@ class DownloadTestCase(unittest.TestCase):
         cwldep.download(tgt="myfile.cwl", url="someurl", version="1",
                         locks=locks, verified=verified, check_only=True)
         mock_logging.info.assert_called_with('Fetching %s to %s', 'someurl', 'myrelpath')
-        mock_requests.get.assert_not_called()
+        mock_requests.Session.return_value.get.assert_not_called()
 
     @patch('cwldep.os')
     @patch('cwldep.logging')
@@ -39,7 +46,7 @@ class DownloadTestCase(unittest.TestCase):
             call('Up to date: %s', 'myrelpath'),
         ])
         mock_logging.warn.assert_not_called()
-        mock_requests.get.assert_called_with('someurl', stream=True)
+        mock_requests.Session.return_value.get.assert_called_with('someurl', stream=True, headers={}, timeout=60)
 
     @patch('cwldep.os')
     @patch('cwldep.logging')
@@ -63,7 +70,7 @@ class DownloadTestCase(unittest.TestCase):
 
         mock_logging.info.assert_called_with('Fetching %s to %s', 'someurl', 'myrelpath')
         mock_logging.warn.assert_called_with('Upstream has changed: %s', 'myrelpath')
-        mock_requests.get.assert_called_with('someurl', stream=True)
+        mock_requests.Session.return_value.get.assert_called_with('someurl', stream=True, headers={}, timeout=60)
 
     @patch('cwldep.os')
     @patch('cwldep.logging')
@@ -76,7 +83,7 @@ class DownloadTestCase(unittest.TestCase):
         mock_os.path.isfile.return_value = True
         mock_os.path.relpath.return_value = 'myrelpath'
         mock_hashlib.sha1.return_value.hexdigest.return_value = '00myhash123'
-        mock_requests.get.return_value.__enter__.return_value.iter_content.return_value = ['cwlVersion: v1.0']
+        mock_requests.Session.return_value.get.return_value.__enter__.return_value.iter_content.return_value = ['cwlVersion: v1.0']
         mocked_open = mock_open()
 
         with patch("cwldep.open", mocked_open):
@@ -86,12 +93,290 @@ class DownloadTestCase(unittest.TestCase):
 
         mock_logging.info.assert_called_with('Fetching %s to %s', 'someurl', 'myrelpath')
         mock_logging.warn.assert_called_with('Upstream has changed: %s', 'myrelpath')
-        mock_requests.get.assert_called_with('someurl', stream=True)
+        mock_requests.Session.return_value.get.assert_called_with('someurl', stream=True, headers={}, timeout=60)
 
         mock_os.rename.assert_called_with('myfile.cwl_download_', 'myfile.cwl')
         self.assertEqual(verified['myrelpath']['checksum'], '00myhash123')
         self.assertEqual(verified['myrelpath']['installed_to'], ['myrelpath'])
 
+    @patch('cwldep.os')
+    @patch('cwldep.logging')
+    @patch('cwldep.requests')
+    def test_download_check_only_not_modified(self, mock_requests, mock_logging, mock_os):
+        verified = {}
+        locks = {'myrelpath': {'checksum': '00myhash123', 'etag': '"abc"',
+                               'last_modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}}
+        mock_os.path.isfile.return_value = True
+        mock_os.path.relpath.return_value = 'myrelpath'
+        mock_requests.Session.return_value.get.return_value.__enter__.return_value.status_code = 304
+        mocked_open = mock_open()
+        with patch("cwldep.open", mocked_open):
+            cwldep.download(tgt="myfile.cwl", url="someurl", version="1",
+                            locks=locks, verified=verified, check_only=True)
+        mock_requests.Session.return_value.get.assert_called_with('someurl', stream=True, headers={
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': 'Mon, 01 Jan 2018 00:00:00 GMT'}, timeout=60)
+        mocked_open.assert_not_called()
+        mock_logging.info.assert_called_with('Up to date: %s', 'myrelpath')
+
+    @patch('cwldep.os')
+    @patch('cwldep.logging')
+    @patch('cwldep.requests')
+    @patch('cwldep.hashlib')
+    def test_download_records_validators(self, mock_hashlib, mock_requests, mock_logging, mock_os):
+        verified = {}
+        mock_os.path.relpath.return_value = 'myrelpath'
+        mock_hashlib.sha1.return_value.hexdigest.return_value = '00myhash123'
+        response = mock_requests.Session.return_value.get.return_value.__enter__.return_value
+        response.status_code = 200
+        response.iter_content.return_value = ['cwlVersion: v1.0']
+        response.headers = {'ETag': '"abc"'}
+        with patch("cwldep.open", mock_open()):
+            cwldep.download(tgt="myfile.cwl", url="someurl", version="1",
+                            locks={}, verified=verified, check_only=False)
+        self.assertEqual(verified['myrelpath']['etag'], '"abc"')
+        self.assertNotIn('last_modified', verified['myrelpath'])
+
+
+class MakeSessionTestCase(unittest.TestCase):
+    def test_make_session_retries(self):
+        session = cwldep.make_session(pool_size=4, retries=5, backoff=2)
+        adapter = session.get_adapter("https://raw.githubusercontent.com/some.cwl")
+        self.assertEqual(adapter.max_retries.total, 5)
+        self.assertEqual(adapter.max_retries.backoff_factor, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertEqual(adapter._pool_maxsize, 4)
+
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_make_session_default_timeout(self, mock_send):
+        session = cwldep.make_session(timeout=7)
+        adapter = session.get_adapter("https://raw.githubusercontent.com/some.cwl")
+        adapter.send("request")
+        mock_send.assert_called_with("request", timeout=7)
+        adapter.send("request", timeout=3)
+        mock_send.assert_called_with("request", timeout=3)
+
+
+class DownloadArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as t:
+            data = b"cwlVersion: v1.0"
+            info = tarfile.TarInfo("pkg/tool.cwl")
+            info.size = len(data)
+            t.addfile(info, io.BytesIO(data))
+        self.archive = buf.getvalue()
+        self.session = MagicMock()
+        response = self.session.get.return_value.__enter__.return_value
+        response.status_code = 200
+        response.headers = {}
+        response.raw = io.BytesIO(self.archive)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_download_archive_streaming(self):
+        tgt = os.path.join(self.tmp, "pkg.tar.gz")
+        context = cwldep.DepContext(session=self.session, keep_archives=False)
+        entry, names = cwldep.download_archive(tgt, "http://example.com/pkg.tar.gz", self.tmp,
+                                               {}, {}, context)
+        self.assertEqual(names, ["pkg/tool.cwl"])
+        self.assertEqual(entry["checksum"], hashlib.sha1(self.archive).hexdigest())
+        self.assertEqual(entry["installed_to"], [])
+        self.assertFalse(os.path.exists(tgt))
+        with open(os.path.join(self.tmp, "pkg", "tool.cwl")) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.0")
+
+    def test_download_archive_keep(self):
+        tgt = os.path.join(self.tmp, "pkg.tar.gz")
+        context = cwldep.DepContext(session=self.session, keep_archives=True)
+        entry, names = cwldep.download_archive(tgt, "http://example.com/pkg.tar.gz", self.tmp,
+                                               {}, {}, context)
+        self.assertEqual(entry["installed_to"], [os.path.relpath(tgt, os.getcwd())])
+        with open(tgt, "rb") as f:
+            self.assertEqual(f.read(), self.archive)
+
+    def test_download_archive_resume(self):
+        tgt = os.path.join(self.tmp, "pkg.tar.gz")
+        half = len(self.archive) // 2
+        with open(tgt + "_download_", "wb") as f:
+            f.write(self.archive[:half])
+        with open(tgt + "_download_.json", "w") as f:
+            f.write('{"url": "http://example.com/pkg.tar.gz", "validator": "\\"abc\\""}')
+        response = self.session.get.return_value.__enter__.return_value
+        response.status_code = 206
+        response.headers = {"Content-Range": "bytes %d-%d/%d" % (half, len(self.archive) - 1, len(self.archive))}
+        response.raw = io.BytesIO(self.archive[half:])
+        context = cwldep.DepContext(session=self.session, keep_archives=True)
+        entry, names = cwldep.download_archive(tgt, "http://example.com/pkg.tar.gz", self.tmp,
+                                               {}, {}, context)
+        self.assertEqual(names, ["pkg/tool.cwl"])
+        self.assertEqual(entry["checksum"], hashlib.sha1(self.archive).hexdigest())
+        with open(tgt, "rb") as f:
+            self.assertEqual(f.read(), self.archive)
+
+    def test_download_archive_frozen_mismatch_extracts_nothing(self):
+        tgt = os.path.join(self.tmp, "pkg.tar.gz")
+        installed = os.path.join(self.tmp, "pkg", "tool.cwl")
+        os.makedirs(os.path.dirname(installed))
+        with open(installed, "w") as f:
+            f.write("cwlVersion: v1.2")
+        locks = {os.path.relpath(tgt, os.getcwd()): {"checksum": "0" * 40}}
+        context = cwldep.DepContext(session=self.session, keep_archives=False, frozen=True)
+        with self.assertRaises(cwldep.LockMismatch):
+            cwldep.download_archive(tgt, "http://example.com/pkg.tar.gz", self.tmp,
+                                    locks, {}, context)
+        with open(installed) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.2")
+        self.assertEqual(os.listdir(self.tmp), ["pkg"])
+
+    def test_download_archive_frozen_match(self):
+        tgt = os.path.join(self.tmp, "pkg.tar.gz")
+        locks = {os.path.relpath(tgt, os.getcwd()): {"checksum": hashlib.sha1(self.archive).hexdigest()}}
+        context = cwldep.DepContext(session=self.session, keep_archives=False, frozen=True)
+        entry, names = cwldep.download_archive(tgt, "http://example.com/pkg.tar.gz", self.tmp,
+                                               locks, {}, context)
+        self.assertEqual(names, ["pkg/tool.cwl"])
+        with open(os.path.join(self.tmp, "pkg", "tool.cwl")) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.0")
+
+
+class ExtractArchiveTestCase(unittest.TestCase):
+    members = ["pkg/tools/a.cwl", "pkg/tools/b.cwl", "pkg/data/big.bin", "pkg/README"]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _installed(self):
+        found = []
+        for root, dirs, files in os.walk(self.tmp):
+            found.extend(os.path.relpath(os.path.join(root, f), self.tmp) for f in files)
+        return sorted(found)
+
+    def test_tar_include(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as t:
+            for name in self.members:
+                info = tarfile.TarInfo(name)
+                info.size = len(name)
+                t.addfile(info, io.BytesIO(name.encode("utf-8")))
+        buf.seek(0)
+        names = cwldep.extract_archive(buf, self.tmp, False, ["pkg/tools/*.cwl"])
+        self.assertEqual(names, ["pkg/tools/a.cwl", "pkg/tools/b.cwl"])
+        self.assertEqual(self._installed(), ["pkg/tools/a.cwl", "pkg/tools/b.cwl"])
+
+    def test_zip_parallel(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            for name in self.members:
+                z.writestr(name, name)
+        names = cwldep.extract_archive(buf, self.tmp, True, ["*.cwl", "pkg/README"], jobs=4)
+        self.assertEqual(sorted(names), ["pkg/README", "pkg/tools/a.cwl", "pkg/tools/b.cwl"])
+        self.assertEqual(self._installed(), ["pkg/README", "pkg/tools/a.cwl", "pkg/tools/b.cwl"])
+        with open(os.path.join(self.tmp, "pkg", "tools", "b.cwl")) as f:
+            self.assertEqual(f.read(), "pkg/tools/b.cwl")
+
+    def test_install_archive_records_members(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as z:
+            for name in self.members:
+                z.writestr(name, name)
+        session = MagicMock()
+        response = session.get.return_value.__enter__.return_value
+        response.status_code = 200
+        response.headers = {}
+        response.raw = io.BytesIO(buf.getvalue())
+        tgt = os.path.join(self.tmp, "pkg.zip")
+        verified = {}
+        cwldep.install_archive(tgt, "http://example.com/pkg.zip", self.tmp, {}, verified, "install",
+                               cwldep.DepContext(session=session, keep_archives=False), ["pkg/tools/*"])
+        entry = verified[os.path.relpath(tgt, os.getcwd())]
+        self.assertEqual(entry["include"], ["pkg/tools/*"])
+        self.assertEqual(entry["installed_to"], [os.path.relpath(os.path.join(self.tmp, "pkg", "tools", n),
+                                                                 os.getcwd()) for n in ("a.cwl", "b.cwl")])
+
+
+class ResumeDownloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tgt = os.path.join(self.tmp, "big.cwl")
+        self.dltgt = self.tgt + "_download_"
+        self.rel = os.path.relpath(self.tgt, os.getcwd())
+        self.data = b"cwlVersion: v1.0\n" * 100
+        self.locks = {self.rel: {"checksum": hashlib.sha1(self.data).hexdigest()}}
+        self.session = MagicMock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _response(self, status, chunks, headers):
+        r = MagicMock()
+        r.__enter__.return_value = r
+        r.status_code = status
+        r.headers = headers
+        r.iter_content.side_effect = lambda size: iter(chunks)
+        return r
+
+    def _partial(self, size):
+        with open(self.dltgt, "wb") as f:
+            f.write(self.data[:size])
+        with open(self.dltgt + ".json", "w") as f:
+            f.write('{"url": "http://example.com/big.cwl", "validator": "\\"abc\\""}')
+
+    def test_resume(self):
+        self._partial(1000)
+        self.session.get.return_value = self._response(
+            206, [self.data[1000:]], {"Content-Range": "bytes 1000-1699/1700", "ETag": '"abc"'})
+        verified = {}
+        cwldep.download(self.tgt, "http://example.com/big.cwl", "", self.locks, verified, False,
+                        cwldep.DepContext(session=self.session))
+        self.assertEqual(self.session.get.call_args[1]["headers"],
+                         {"Range": "bytes=1000-", "If-Range": '"abc"', "Accept-Encoding": "identity"})
+        with open(self.tgt, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(verified[self.rel]["checksum"], self.locks[self.rel]["checksum"])
+        self.assertFalse(os.path.exists(self.dltgt + ".json"))
+
+    def test_resume_not_supported(self):
+        self._partial(1000)
+        self.session.get.return_value = self._response(200, [self.data], {})
+        cwldep.download(self.tgt, "http://example.com/big.cwl", "", self.locks, {}, False,
+                        cwldep.DepContext(session=self.session))
+        with open(self.tgt, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_resumed_mismatch_refetches(self):
+        self._partial(1000)
+        with open(self.dltgt, "wb") as f:
+            f.write(b"garbage!" * 125)
+        self.session.get.side_effect = [
+            self._response(206, [self.data[1000:]], {"Content-Range": "bytes 1000-1699/1700"}),
+            self._response(200, [self.data], {})]
+        cwldep.download(self.tgt, "http://example.com/big.cwl", "", self.locks, {}, False,
+                        cwldep.DepContext(session=self.session))
+        self.assertEqual(self.session.get.call_args[1]["headers"], {})
+        with open(self.tgt, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_interrupted_download(self):
+        def broken(size):
+            yield self.data[:1000]
+            raise IOError("connection reset")
+
+        for headers, resumable in (({}, False), ({"Accept-Ranges": "bytes", "ETag": '"abc"'}, True)):
+            r = self._response(200, [], headers)
+            r.iter_content.side_effect = broken
+            self.session.get.return_value = r
+            with self.assertRaises(IOError):
+                cwldep.download(self.tgt, "http://example.com/big.cwl", "", self.locks, {}, False,
+                                cwldep.DepContext(session=self.session))
+            self.assertEqual(os.path.exists(self.dltgt), resumable)
+            self.assertEqual(os.path.exists(self.dltgt + ".json"), resumable)
+
 
 class VerifyTestCase(unittest.TestCase):
     @patch('cwldep.os')
@@ -110,6 +395,7 @@ class VerifyTestCase(unittest.TestCase):
         verified = {}
 
         mocked_open = mock_open()
+        mocked_open.return_value.readinto.return_value = 0
         with patch("cwldep.open", mocked_open):
             self.assertEqual(cwldep.verify(tgt="sometarget.cwl",
                                            locks={'myrelpath': {'checksum':'00myhash123'}},
@@ -125,6 +411,7 @@ class VerifyTestCase(unittest.TestCase):
         verified = {}
 
         mocked_open = mock_open()
+        mocked_open.return_value.readinto.return_value = 0
         with patch("cwldep.open", mocked_open):
             self.assertEqual(cwldep.verify(tgt="sometarget.cwl",
                                            locks={'myrelpath': {'checksum':'00myhash123'}},
@@ -132,24 +419,152 @@ class VerifyTestCase(unittest.TestCase):
         mocked_open.assert_called_with("sometarget.cwl", "rb")
 
 
+class StatIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tgt = os.path.join(self.tmp, "a.cwl")
+        with open(self.tgt, "w") as f:
+            f.write("cwlVersion: v1.0")
+        os.utime(self.tgt, (0, 0))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_lookup_unchanged(self):
+        index = cwldep.StatIndex()
+        index.record(self.tgt, "a.cwl", "00myhash123")
+        self.assertEqual(index.lookup(self.tgt, "a.cwl"), "00myhash123")
+
+    def test_lookup_modified(self):
+        index = cwldep.StatIndex()
+        index.record(self.tgt, "a.cwl", "00myhash123")
+        with open(self.tgt, "w") as f:
+            f.write("cwlVersion: v1.10")
+        os.utime(self.tgt, (0, 0))
+        self.assertIsNone(index.lookup(self.tgt, "a.cwl"))
+
+    def test_lookup_racy(self):
+        os.utime(self.tgt, None)
+        index = cwldep.StatIndex()
+        index.record(self.tgt, "a.cwl", "00myhash123")
+        self.assertIsNone(index.lookup(self.tgt, "a.cwl"))
+
+    def test_save_and_load(self):
+        path = os.path.join(self.tmp, "main.cwl.dep.index")
+        index = cwldep.StatIndex(path)
+        index.record(self.tgt, "a.cwl", "00myhash123")
+        index.record(self.tgt, "gone.cwl", "77otherhash890")
+        index.save({"a.cwl": {}})
+        index = cwldep.StatIndex(path)
+        self.assertEqual(index.lookup(self.tgt, "a.cwl"), "00myhash123")
+        self.assertIsInstance(index.entries["a.cwl"], cwldep.StatIndex.Entry)
+        self.assertNotIn("gone.cwl", index.entries)
+
+    @patch('cwldep.hashlib')
+    def test_verify_trusts_index(self, mock_hashlib):
+        index = cwldep.StatIndex()
+        rel = os.path.relpath(self.tgt, os.getcwd())
+        index.record(self.tgt, rel, "00myhash123")
+        verified = {}
+        locks = {rel: {"checksum": "00myhash123"}}
+        context = cwldep.DepContext(stat_index=index)
+        self.assertTrue(cwldep.verify(self.tgt, locks, verified, context))
+        mock_hashlib.sha1.assert_not_called()
+        self.assertEqual(verified[rel], locks[rel])
+
+        context = cwldep.DepContext(stat_index=index, paranoid=True)
+        mock_hashlib.sha1.return_value.hexdigest.return_value = "00myhash123"
+        self.assertTrue(cwldep.verify(self.tgt, locks, verified, context))
+        mock_hashlib.sha1.assert_called_with()
+
+
+class ChecksumTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tgt = os.path.join(self.tmp, "a.cwl")
+        with open(self.tgt, "wb") as f:
+            f.write(b"cwlVersion: v1.0")
+        self.rel = os.path.relpath(self.tgt, os.getcwd())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_file_checksum(self):
+        self.assertEqual(cwldep.file_checksum(self.tgt),
+                         hashlib.sha1(b"cwlVersion: v1.0").hexdigest())
+        self.assertEqual(cwldep.file_checksum(self.tgt, "sha256"),
+                         "sha256:" + hashlib.sha256(b"cwlVersion: v1.0").hexdigest())
+        with self.assertRaises(ValueError):
+            cwldep.file_checksum(self.tgt, "md5")
+
+    def test_checksum_algorithm(self):
+        self.assertEqual(cwldep.checksum_algorithm("00myhash123"), "sha1")
+        self.assertEqual(cwldep.checksum_algorithm("blake2b:00myhash123"), "blake2b")
+        self.assertEqual(cwldep.lock_algorithm({}), "sha1")
+        self.assertEqual(cwldep.lock_algorithm({
+            "a": {"checksum": "sha256:00"}, "b": {"checksum": "sha256:11"}, "c": {"checksum": "22"},
+            "d": {"version": "abc"}}), "sha256")
+
+    def test_verify_sha256(self):
+        locks = {self.rel: {"checksum": cwldep.file_checksum(self.tgt, "sha256")}}
+        verified = {}
+        context = cwldep.DepContext(hash_algorithm="sha256")
+        self.assertTrue(cwldep.verify(self.tgt, locks, verified, context))
+        self.assertEqual(verified[self.rel], locks[self.rel])
+
+    def test_verify_migrates_sha1(self):
+        locks = {self.rel: {"checksum": cwldep.file_checksum(self.tgt), "upstream": "u"}}
+        verified = {}
+        context = cwldep.DepContext(hash_algorithm="blake2b", stat_index=cwldep.StatIndex())
+        self.assertTrue(cwldep.verify(self.tgt, locks, verified, context))
+        self.assertEqual(verified[self.rel], {"checksum": cwldep.file_checksum(self.tgt, "blake2b"),
+                                              "upstream": "u"})
+
+        locks = {self.rel: {"checksum": "77otherhash890"}}
+        self.assertFalse(cwldep.verify(self.tgt, locks, {}, context))
+
+
 class LoadNoCheckTestCase(unittest.TestCase):
-    @patch('cwldep.cwltool')
-    @patch('cwldep.schema_salad.ref_resolver')
-    def test_load_nocheck(self, mock_ref_resolver, mock_cwltool):
+    @patch('cwltool.load_tool.fetch_document')
+    @patch('schema_salad.ref_resolver.Loader')
+    def test_load_nocheck(self, mock_loader_class, mock_fetch_document):
         mock_loader = Mock()
         mock_workflowobj = {
             "cwlVersion": "v1.0",
             "id": "myid",
             'class': 'Workflow',
         }
-        mock_cwltool.load_tool.fetch_document.return_value = mock_loader, mock_workflowobj, "uri"
+        mock_fetch_document.return_value = mock_loader, mock_workflowobj, "uri"
         mock_document = Mock()
-        mock_ref_resolver.Loader.return_value.resolve_all.return_value = mock_document, None
+        mock_loader_class.return_value.resolve_all.return_value = mock_document, None
         mock_upstream = Mock()
 
         self.assertEqual(cwldep.load_nocheck(mock_upstream), (mock_document, mock_loader))
 
 
+class SchemaContextTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        cwldep._schema_contexts.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        cwldep._schema_contexts.clear()
+
+    @patch('cwltool.process.get_schema')
+    def test_schema_context_memoized(self, mock_get_schema):
+        mock_get_schema.return_value[0].ctx = {"cwl": "https://w3id.org/cwl/cwl#"}
+        ctx = cwldep.schema_context("v1.0", self.tmp)
+        self.assertEqual(ctx["upstream"], {"@type": "@id"})
+        self.assertIs(cwldep.schema_context("v1.0", self.tmp), ctx)
+        self.assertEqual(mock_get_schema.call_count, 1)
+
+        # A new process loads the saved context instead of the schema.
+        cwldep._schema_contexts.clear()
+        self.assertEqual(cwldep.schema_context("v1.0", self.tmp), ctx)
+        self.assertEqual(mock_get_schema.call_count, 1)
+
+
 class CWLDepsTestCase(unittest.TestCase):
     @patch('cwldep.os')
     @patch('cwldep.urllib')
@@ -164,7 +579,8 @@ class CWLDepsTestCase(unittest.TestCase):
                 }
             ]
         }
-        mock_urllib.parse.urlsplit.return_value = Mock(scheme='ftp')
+        mock_urllib.parse.urlsplit.return_value = Mock(scheme='ftp', netloc='raw.githubusercontent.com',
+                                                        path='/some.cwl', query='')
         cwldep.cwl_deps(basedir="/tmp",
                         dependencies=dependencies,
                         locks=locks,
@@ -175,10 +591,9 @@ class CWLDepsTestCase(unittest.TestCase):
     @patch('cwldep.os')
     @patch('cwldep.urllib')
     @patch('cwldep.logging')
-    @patch('cwldep.cwltool')
     @patch('cwldep.load_nocheck')
     @patch('cwldep.download')
-    def test_cwl_deps_good_scheme(self, mock_download, mock_load_nocheck, mock_cwltool, mock_logging, mock_urllib, mock_os):
+    def test_cwl_deps_good_scheme(self, mock_download, mock_load_nocheck, mock_logging, mock_urllib, mock_os):
         locks = {}
         verified = {}
         dependencies = {
@@ -188,8 +603,8 @@ class CWLDepsTestCase(unittest.TestCase):
                 }
             ]
         }
-        mock_urllib.parse.urlsplit.return_value = Mock(scheme='http', path="somepath.cwl")
-        mock_cwltool.load_tool.fetch_document.return_value = (None, None, None)
+        mock_urllib.parse.urlsplit.return_value = Mock(scheme='http', netloc='raw.githubusercontent.com',
+                                                        path="somepath.cwl", query='')
         mock_document = Mock()
         mock_document_loader = Mock()
         mock_load_nocheck.return_value = (mock_document, mock_document_loader)
@@ -200,7 +615,521 @@ class CWLDepsTestCase(unittest.TestCase):
                         operation="check")
 
         mock_download.assert_called_with(mock_os.path.join.return_value,
-                                         'https://raw.githubusercontent.com/some.cwl', '', {}, {}, True)
+                                         'https://raw.githubusercontent.com/some.cwl', '', {}, {}, True, ANY)
+
+
+class GraphCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "main.cwl.dep.graph")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_save_and_lookup(self):
+        graph = cwldep.GraphCache(self.path)
+        sfs = [{"class": "File", "location": "http://example.com/b.cwl"}]
+        deps = [{"dependencies": [{"upstream": "http://example.com/c.cwl"}]}]
+        graph.record("http://example.com/a.cwl", ["a.cwl", "b.cwl"], sfs, deps)
+        graph.record("http://example.com/x.cwl", ["x.cwl"], [], [])
+        graph.save({"a.cwl": {"checksum": "00myhash123"}, "b.cwl": {"checksum": "77otherhash890"}})
+
+        graph = cwldep.GraphCache(self.path)
+        self.assertNotIn("http://example.com/x.cwl", graph.entries)
+        locks = {"a.cwl": {"checksum": "00myhash123"}, "b.cwl": {"checksum": "77otherhash890"}}
+        self.assertEqual(graph.lookup("http://example.com/a.cwl", locks), (sfs, deps))
+        locks["b.cwl"] = {"checksum": "00changed"}
+        self.assertIsNone(graph.lookup("http://example.com/a.cwl", locks))
+
+    def test_save_drops_reused_entry_when_upstream_changed(self):
+        graph = cwldep.GraphCache(self.path)
+        graph.entries["http://example.com/t.cwl"] = {
+            "checksums": {"t.cwl": "00old"}, "secondaryFiles": ["old-sf"], "dependencies": []}
+        graph.entries["http://example.com/u.cwl"] = {
+            "checksums": {"u.cwl": "00same"}, "secondaryFiles": [], "dependencies": []}
+        locks = {"t.cwl": {"checksum": "00old"}, "u.cwl": {"checksum": "00same"}}
+        self.assertIsNotNone(graph.lookup("http://example.com/t.cwl", locks))
+        self.assertIsNotNone(graph.lookup("http://example.com/u.cwl", locks))
+        graph.save({"t.cwl": {"checksum": "00new"}, "u.cwl": {"checksum": "00same"}})
+
+        graph = cwldep.GraphCache(self.path)
+        self.assertNotIn("http://example.com/t.cwl", graph.entries)
+        self.assertEqual(graph.entries["http://example.com/u.cwl"]["checksums"], {"u.cwl": "00same"})
+
+    def test_lookup_needs_installed_files(self):
+        graph = cwldep.GraphCache(self.path)
+        graph.entries["http://example.com/a.cwl"] = {
+            "checksums": {"a.cwl": "00myhash123"}, "secondaryFiles": [], "dependencies": []}
+        locks = {"a.cwl": {"checksum": "00myhash123"}}
+        self.assertIsNone(graph.lookup("http://example.com/a.cwl", locks, lambda rel: False))
+        self.assertNotIn("http://example.com/a.cwl", graph.used)
+        self.assertEqual(graph.lookup("http://example.com/a.cwl", locks, lambda rel: True), ([], []))
+
+    @patch('cwldep.scan')
+    def test_cwl_deps_rescans_missing_document(self, mock_scan):
+        mock_scan.return_value = [], []
+        rel = os.path.relpath(os.path.join(self.tmp, "example.com", "a.cwl"), os.getcwd())
+        graph = cwldep.GraphCache()
+        graph.entries["http://example.com/a.cwl"] = {
+            "checksums": {rel: "00old"}, "secondaryFiles": [{"class": "File", "location": "http://example.com/b.cwl"}],
+            "dependencies": []}
+        dependencies = {'dependencies': [{'upstream': 'http://example.com/a.cwl'}]}
+        cwldep.cwl_deps(basedir=self.tmp, dependencies=dependencies, locks={rel: {"checksum": "00old"}},
+                        verified={}, operation="graph", context=cwldep.DepContext(graph=graph))
+        self.assertEqual(mock_scan.call_count, 1)
+        self.assertEqual(graph.used["http://example.com/a.cwl"]["secondaryFiles"], [])
+
+    @patch('cwldep.load_nocheck')
+    @patch('cwldep.download')
+    @patch('cwldep.verify')
+    def test_cwl_deps_reuses_graph(self, mock_verify, mock_download, mock_load_nocheck):
+        mock_verify.return_value = True
+        graph = cwldep.GraphCache()
+        graph.entries["http://example.com/a.cwl"] = {
+            "checksums": {},
+            "secondaryFiles": [{"class": "File", "location": "http://example.com/b.cwl"}],
+            "dependencies": []
+        }
+        dependencies = {'dependencies': [{'upstream': 'http://example.com/a.cwl'}]}
+        cwldep.cwl_deps(basedir=self.tmp, dependencies=dependencies, locks={}, verified={},
+                        operation="install", context=cwldep.DepContext(graph=graph))
+        mock_load_nocheck.assert_not_called()
+        self.assertEqual(sorted(os.path.basename(c[0][0]) for c in mock_verify.call_args_list),
+                         ["a.cwl", "b.cwl"])
+
+
+class FrozenInstallTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.rel = os.path.relpath(os.path.join(self.tmp, "a.cwl"), os.getcwd())
+        self.session = MagicMock()
+        response = self.session.get.return_value.__enter__.return_value
+        response.status_code = 200
+        response.headers = {}
+        response.iter_content.return_value = [b"cwlVersion: v1.0"]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    @patch('cwldep.load_nocheck')
+    def test_install_frozen(self, mock_load_nocheck):
+        locks = {self.rel: {"upstream": "http://example.com/a.cwl", "version": "",
+                            "checksum": hashlib.sha1(b"cwlVersion: v1.0").hexdigest(),
+                            "installed_to": [self.rel]}}
+        verified = {}
+        context = cwldep.DepContext(session=self.session, frozen=True)
+        cwldep.install_frozen(locks, verified, context)
+        context.pool.wait()
+        mock_load_nocheck.assert_not_called()
+        self.assertEqual(verified[self.rel]["checksum"], locks[self.rel]["checksum"])
+        with open(self.rel) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.0")
+
+        # Installed files that match are not fetched again.
+        self.session.get.reset_mock()
+        cwldep.install_frozen(locks, {}, context)
+        self.session.get.assert_not_called()
+
+    def test_install_frozen_mismatch(self):
+        locks = {self.rel: {"upstream": "http://example.com/a.cwl", "version": "",
+                            "checksum": "00myhash123", "installed_to": [self.rel]}}
+        context = cwldep.DepContext(session=self.session, frozen=True)
+        with self.assertRaises(cwldep.LockMismatch):
+            cwldep.install_frozen(locks, {}, context)
+        self.assertFalse(os.path.exists(self.rel))
+
+
+class BundleInstallTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.rel = os.path.relpath(os.path.join(self.tmp, "a.cwl"), os.getcwd())
+        self.locks = {self.rel: {"upstream": "http://example.com/a.cwl", "version": "",
+                                 "checksum": hashlib.sha1(b"cwlVersion: v1.0").hexdigest(),
+                                 "installed_to": [self.rel]}}
+        self.path = os.path.join(self.tmp, "main.cwl.dep.bundle")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_bundle_and_install(self):
+        session = MagicMock()
+        response = session.get.return_value.__enter__.return_value
+        response.status_code = 200
+        response.iter_content.return_value = [b"cwlVersion: v1.0"]
+        cwldep.create_bundle(self.path, self.locks, cwldep.DepContext(session=session))
+        session.get.assert_called_with("http://example.com/a.cwl", stream=True, timeout=60)
+
+        session = MagicMock()
+        verified = {}
+        context = cwldep.DepContext(session=session, frozen=True, bundle=cwldep.Bundle(self.path))
+        cwldep.install_frozen(self.locks, verified, context)
+        session.get.assert_not_called()
+        self.assertEqual(verified[self.rel], self.locks[self.rel])
+        with open(self.rel) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.0")
+
+    def test_install_missing_from_bundle(self):
+        writer = cwldep.BundleWriter(self.path)
+        writer.close(self.locks)
+        context = cwldep.DepContext(frozen=True, bundle=cwldep.Bundle(self.path))
+        with self.assertRaises(cwldep.LockMismatch):
+            cwldep.install_frozen(self.locks, {}, context)
+
+
+class DependencyGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_canonical_url(self):
+        self.assertEqual(cwldep.canonical_url("HTTP://Example.com:80/tools//./a/../b.cwl#main"),
+                         "http://example.com/tools/b.cwl")
+        self.assertEqual(cwldep.canonical_url("https://example.com:8443/b.cwl?x=1"),
+                         "https://example.com:8443/b.cwl?x=1")
+
+    def test_cycle_and_plan(self):
+        graph = cwldep.DependencyGraph()
+        a = graph.key("http://example.com/a.cwl", None, self.tmp)
+        b = graph.key("http://example.com/b.cwl", None, self.tmp)
+        c = graph.key("http://example.com/c.cwl", None, self.tmp)
+        self.assertTrue(graph.add(a, None))
+        self.assertTrue(graph.add(b, a))
+        self.assertTrue(graph.add(c, a))
+        self.assertFalse(graph.add(c, b))
+        self.assertEqual(graph.cycle("http://example.com:80/a.cwl", b),
+                         ["http://example.com/a.cwl", "http://example.com/b.cwl", "http://example.com/a.cwl"])
+        self.assertIsNone(graph.cycle("http://example.com/d.cwl", b))
+        self.assertEqual([n["upstream"] for n in graph.plan()],
+                         ["http://example.com/c.cwl", "http://example.com/b.cwl", "http://example.com/a.cwl"])
+
+    @patch('cwldep.scan_document')
+    @patch('cwldep.download')
+    @patch('cwldep.verify')
+    def test_cwl_deps_diamond(self, mock_verify, mock_download, mock_scan_document):
+        mock_verify.return_value = True
+        leaf = {"dependencies": [{"upstream": "http://example.com/d.cwl", "installTo": "."}]}
+        documents = {
+            "http://example.com/a.cwl": [{"dependencies": [
+                {"upstream": "http://example.com/b.cwl", "installTo": "."},
+                {"upstream": "http://example.com/c.cwl", "installTo": "."}]}],
+            "http://example.com/b.cwl": [leaf],
+            "http://example.com/c.cwl": [leaf],
+            "http://example.com/d.cwl": [{"dependencies": [
+                {"upstream": "http://example.com/a.cwl", "installTo": "."}]}],
+        }
+        mock_scan_document.side_effect = lambda upstream, *args: ([], documents[upstream], True)
+        context = cwldep.DepContext(jobs=4)
+        cwldep.cwl_deps(self.tmp, {"dependencies": [{"upstream": "http://example.com/a.cwl", "installTo": "."}]},
+                        {}, {}, "install", context)
+        context.pool.wait()
+        context.pool.shutdown()
+        self.assertEqual(sorted(c[0][0] for c in mock_scan_document.call_args_list),
+                         sorted(documents))
+        self.assertEqual(sorted(os.path.basename(c[0][0]) for c in mock_verify.call_args_list),
+                         ["a.cwl", "b.cwl", "c.cwl", "d.cwl"])
+        self.assertEqual(context.resolved.plan()[0]["upstream"], "http://example.com/d.cwl")
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def resolve(self, operation, mock_install_git):
+        def install_git(upstream, tgt, version, locks, verified, operation, context, source=None):
+            context.record(verified, os.path.relpath(tgt, os.getcwd()), {"version": "abc"})
+        mock_install_git.side_effect = install_git
+
+        context = cwldep.DepContext(jobs=2)
+        req = {"dependencies": [{"upstream": "file:///repos/tools", "installTo": "tools"}]}
+        roots = [context.for_root(), context.for_root()]
+        verified = [{}, {}]
+        with patch('cwldep.git.is_repository', return_value=True):
+            for root, v in zip(roots, verified):
+                cwldep.cwl_deps(self.tmp, req, {}, v, operation, root)
+            context.pool.wait()
+        context.pool.shutdown()
+        return verified
+
+    @patch('cwldep.install_git')
+    def test_shared_upstream_installed_once(self, mock_install_git):
+        verified = self.resolve("install", mock_install_git)
+        self.assertEqual(mock_install_git.call_count, 1)
+        rel = os.path.relpath(os.path.join(self.tmp, "tools", "tools"), os.getcwd())
+        self.assertEqual(verified, [{rel: {"version": "abc"}}, {rel: {"version": "abc"}}])
+
+    @patch('cwldep.check_git')
+    @patch('cwldep.install_git')
+    def test_check_uses_each_lock(self, mock_install_git, mock_check_git):
+        self.resolve("check", mock_install_git)
+        mock_install_git.assert_not_called()
+        self.assertEqual(mock_check_git.call_count, 2)
+
+    def test_expand_workflows(self):
+        for fn in ("a.cwl", "b.cwl", "a.cwl.dep.lock"):
+            open(os.path.join(self.tmp, fn), "w").close()
+        a = os.path.join(self.tmp, "a.cwl")
+        self.assertEqual(cwldep.expand_workflows([a, os.path.join(self.tmp, "*.cwl*")]),
+                         [a, os.path.join(self.tmp, "b.cwl")])
+
+    def test_clean_keeps_entries_of_other_workflows(self):
+        shared = os.path.join(self.tmp, "shared.cwl")
+        unused = os.path.join(self.tmp, "unused.cwl")
+        for fn in (shared, unused):
+            open(fn, "w").close()
+        locks = {shared: {"installed_to": [shared]}, unused: {"installed_to": [unused]}}
+        context = cwldep.DepContext()
+        other = context.for_root()
+        other.record({}, shared, locks[shared])
+        root = context.for_root(stat_index=Mock(), graph=Mock())
+        lock = Mock()
+        cwldep.finish_workflow("a.cwl", lock, locks, {}, "clean", root)
+        self.assertTrue(os.path.exists(shared))
+        self.assertFalse(os.path.exists(unused))
+        lock.save.assert_called_with({})
+
+    def test_clean_dry_run(self):
+        tree = os.path.join(self.tmp, "archive")
+        os.makedirs(os.path.join(tree, "kept"))
+        for name, content in (("gone.cwl", "abc"), ("kept/tool.cwl", "de")):
+            with open(os.path.join(tree, name), "w") as f:
+                f.write(content)
+        kept = os.path.join(tree, "kept", "tool.cwl")
+        locks = {"archive.tar.gz": {"installed_to": [tree]}, kept: {"installed_to": [kept]}}
+        lock = Mock()
+        with patch("cwldep.print") as mock_print:
+            cwldep.finish_workflow("a.cwl", lock, locks, {kept: locks[kept]}, "clean",
+                                   cwldep.DepContext(), dry_run=True)
+        mock_print.assert_called_with("Would remove 1 paths, reclaiming 3 bytes")
+        self.assertTrue(os.path.exists(os.path.join(tree, "gone.cwl")))
+        lock.save.assert_not_called()
+
+    @patch('cwldep.git.is_repository', Mock(return_value=True))
+    @patch('cwldep.install_archive')
+    @patch('cwldep.install_git')
+    def test_clean_dry_run_fetches_nothing(self, mock_install_git, mock_install_archive):
+        context = cwldep.DepContext(dry_run=True)
+        context.session = Mock()
+        req = {"dependencies": [{"upstream": "file:///repos/tools", "installTo": "tools"},
+                                {"upstream": "https://example.com/pkg.tar.gz", "installTo": "pkg"},
+                                {"upstream": "https://example.com/repo", "installTo": "repo"}]}
+        tools = os.path.relpath(os.path.join(self.tmp, "tools", "tools"), os.getcwd())
+        locks = {tools: {"version": "abc"}, "unused.cwl": {"checksum": "0" * 40}}
+        verified = {}
+        cwldep.cwl_deps(self.tmp, req, locks, verified, "clean", context)
+        context.pool.wait()
+        context.pool.shutdown()
+        mock_install_git.assert_not_called()
+        mock_install_archive.assert_not_called()
+        context.session.get.assert_not_called()
+        self.assertEqual(verified, {tools: {"version": "abc"}})
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    @patch('cwldep.logging')
+    @patch('cwldep.install_git')
+    def test_file_upstream_not_a_repository(self, mock_install_git, mock_logging):
+        tool = os.path.join(self.tmp, "tool.cwl")
+        open(tool, "w").close()
+        req = {"dependencies": [{"upstream": "file://" + tool, "installTo": "tools"}]}
+        context = cwldep.DepContext()
+        cwldep.cwl_deps(self.tmp, req, {}, {}, "install", context)
+        context.pool.wait()
+        context.pool.shutdown()
+        mock_install_git.assert_not_called()
+        mock_logging.error.assert_called_with("Scheme %s not supported", "file")
+
+    @patch('cwldep.verify', Mock(return_value=True))
+    @patch('cwldep.scan')
+    def test_each_workflow_uses_its_own_graph(self, mock_scan):
+        mock_scan.return_value = [], []
+        upstream = "https://example.com/tools/tool.cwl"
+        rel = os.path.relpath(os.path.join(self.tmp, "tools", "tool.cwl"), os.getcwd())
+        context = cwldep.DepContext()
+        first = context.for_root(graph=cwldep.GraphCache())
+        first.graph.entries[upstream] = {"checksums": {rel: "00old"}, "secondaryFiles": [], "dependencies": []}
+        second = context.for_root(graph=cwldep.GraphCache())
+        req = {"dependencies": [{"upstream": upstream, "installTo": "tools"}]}
+        cwldep.cwl_deps(self.tmp, req, {rel: {"checksum": "00old"}}, {}, "graph", first)
+        mock_scan.assert_not_called()
+        cwldep.cwl_deps(self.tmp, req, {rel: {"checksum": "00old"}}, {}, "graph", second)
+        self.assertEqual(mock_scan.call_count, 1)
+        self.assertEqual(second.graph.used[upstream]["files"], [rel])
+
+        # The graph entry of a workflow is checked against its own lock.
+        third = context.for_root(graph=first.graph)
+        cwldep.cwl_deps(self.tmp, req, {rel: {"checksum": "00new"}}, {}, "graph", third)
+        self.assertEqual(mock_scan.call_count, 1)
+        self.assertEqual(third.graph.used[upstream]["files"], [rel])
+
+    @patch('cwldep.logging')
+    @patch('cwldep.fetch_checksum')
+    def test_check_fetches_shared_upstream_once(self, mock_fetch_checksum, mock_logging):
+        mock_fetch_checksum.return_value = "00new"
+        tgt = os.path.join(self.tmp, "tool.cwl")
+        open(tgt, "w").close()
+        rel = os.path.relpath(tgt, os.getcwd())
+        context = cwldep.DepContext()
+        for checksum in ("00new", "00old"):
+            locks = {rel: {"checksum": checksum, "installed_to": [rel]}}
+            cwldep.download(tgt, "https://example.com/tool.cwl", "", locks, {}, True, context.for_root())
+        self.assertEqual(mock_fetch_checksum.call_count, 1)
+        mock_logging.info.assert_any_call("Up to date: %s", rel)
+        mock_logging.warn.assert_called_once_with("Upstream has changed: %s", rel)
+
+    @patch('cwldep.logging')
+    @patch('cwldep.install_archive')
+    def test_include_pattern_string(self, mock_install_archive, mock_logging):
+        context = cwldep.DepContext()
+        req = {"dependencies": [{"upstream": "https://example.com/pkg.tar.gz", "installTo": "pkg",
+                                 "include": "*.cwl"},
+                                {"upstream": "https://example.com/other.tar.gz", "installTo": "other",
+                                 "include": {"pattern": "*.cwl"}}]}
+        cwldep.cwl_deps(self.tmp, req, {}, {}, "install", context)
+        context.pool.wait()
+        context.pool.shutdown()
+        self.assertEqual(mock_install_archive.call_count, 1)
+        self.assertEqual(mock_install_archive.call_args[0][7], ["*.cwl"])
+        mock_logging.error.assert_called_with("include of %s must be a glob pattern or a list of them",
+                                              "https://example.com/other.tar.gz")
+
+    @patch('cwldep.download')
+    @patch('cwldep.scan_document')
+    def test_check_creates_no_directories(self, mock_scan_document, mock_download):
+        mock_scan_document.return_value = [], [], False
+        context = cwldep.DepContext()
+        req = {"dependencies": [{"upstream": "https://example.com/tools/tool.cwl", "installTo": "tools"}]}
+        cwldep.cwl_deps(self.tmp, req, {}, {}, "check", context)
+        context.pool.wait()
+        context.pool.shutdown()
+        self.assertEqual(mock_download.call_count, 1)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+
+class InstallStrategyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def fetch(self, tgt, context, verified):
+        def fetch():
+            with open(tgt, "w") as f:
+                f.write("cwlVersion: v1.0")
+            rel = os.path.relpath(tgt, os.getcwd())
+            context.record(verified, rel, {"upstream": "http://example.com/a.cwl", "checksum": "00myhash123",
+                                           "installed_to": [rel]})
+        return fetch
+
+    def test_link_file(self):
+        context = cwldep.DepContext(install_strategy="hardlink")
+        verified = {}
+        fetched = []
+        targets = [os.path.join(self.tmp, d + ".cwl") for d in ("first", "second", "third")]
+        for tgt in targets:
+            fetch = self.fetch(tgt, context, verified)
+            cwldep.link_file(tgt, "http://example.com/a.cwl", {}, verified, context,
+                             lambda: fetched.append(fetch()))
+        self.assertEqual(len(fetched), 1)
+        self.assertTrue(os.path.samefile(targets[0], targets[2]))
+        rels = [os.path.relpath(tgt, os.getcwd()) for tgt in targets]
+        for rel in rels:
+            self.assertEqual(verified[rel]["installed_to"], [rel])
+            self.assertEqual(verified[rel]["checksum"], "00myhash123")
+        context.batch.list_places(verified)
+        for rel in rels:
+            self.assertEqual(verified[rel]["installed_to"], rels)
+
+    def test_copy_file(self):
+        context = cwldep.DepContext()
+        verified = {}
+        fetched = []
+        targets = [os.path.join(self.tmp, d + ".cwl") for d in ("first", "second")]
+        for tgt in targets:
+            fetch = self.fetch(tgt, context, verified)
+            cwldep.link_file(tgt, "http://example.com/a.cwl", {}, verified, context,
+                             lambda: fetched.append(fetch()))
+        self.assertEqual(len(fetched), 1)
+        self.assertFalse(os.path.samefile(targets[0], targets[1]))
+        with open(targets[1]) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.0")
+
+    @patch('cwldep.download_archive')
+    def test_archive_installed_once(self, mock_download_archive):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as t:
+            data = b"cwlVersion: v1.0"
+            info = tarfile.TarInfo("pkg/tool.cwl")
+            info.size = len(data)
+            t.addfile(info, io.BytesIO(data))
+
+        def download_archive(tgt, url, install_to, locks, verified, context, include=None):
+            with open(tgt, "wb") as f:
+                f.write(buf.getvalue())
+            with open(tgt, "rb") as f:
+                names = cwldep.extract_archive(f, install_to, False)
+            rel = os.path.relpath(tgt, os.getcwd())
+            return {"upstream": url, "checksum": "00myhash123", "installed_to": [rel]}, names
+        mock_download_archive.side_effect = download_archive
+
+        context = cwldep.DepContext(install_strategy="hardlink")
+        verified = {}
+        dirs = [os.path.join(self.tmp, d) for d in ("first", "second")]
+        for d in dirs:
+            os.makedirs(d)
+            cwldep.link_archive(os.path.join(d, "pkg.tar.gz"), "http://example.com/pkg.tar.gz", d,
+                                {}, verified, "install", context)
+        self.assertEqual(mock_download_archive.call_count, 1)
+        self.assertTrue(os.path.samefile(os.path.join(dirs[0], "pkg.tar.gz"), os.path.join(dirs[1], "pkg.tar.gz")))
+        with open(os.path.join(dirs[1], "pkg", "tool.cwl")) as f:
+            self.assertEqual(f.read(), "cwlVersion: v1.0")
+        rel = os.path.relpath(os.path.join(dirs[1], "pkg.tar.gz"), os.getcwd())
+        self.assertEqual(verified[rel]["checksum"], "00myhash123")
+        self.assertEqual(verified[rel]["installed_to"], [rel, os.path.relpath(os.path.join(dirs[1], "pkg"), os.getcwd())])
+
+
+class CheckGitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tgt = os.path.join(self.tmp, "tools")
+        os.mkdir(self.tgt)
+        self.rel = os.path.relpath(self.tgt, os.getcwd())
+        self.locks = {self.rel: {"upstream": "file:///repos/tools", "version": "a" * 40,
+                                 "installed_to": [self.rel]}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    @patch('cwldep.logging')
+    @patch('cwldep.git.ls_remote')
+    def test_check_git_changed(self, mock_ls_remote, mock_logging):
+        mock_ls_remote.return_value = {"HEAD": "b" * 40, "refs/tags/v1": "c" * 40, "refs/tags/v1^{}": "a" * 40}
+        verified = {}
+        cwldep.check_git("file:///repos/tools", self.tgt, None, self.locks, verified, cwldep.DepContext())
+        mock_logging.warn.assert_called_with("Upstream has changed: %s", self.rel)
+        self.assertEqual(verified, self.locks)
+
+        cwldep.check_git("file:///repos/tools", self.tgt, "v1", self.locks, verified, cwldep.DepContext())
+        mock_logging.info.assert_called_with("Up to date: %s", self.rel)
+
+    @patch('cwldep.git.ls_remote')
+    def test_check_git_advertised_refs(self, mock_ls_remote):
+        verified = {}
+        cwldep.check_git("https://example.com/tools", self.tgt, "main", self.locks, verified,
+                         cwldep.DepContext(), {"refs/heads/main": "a" * 40})
+        mock_ls_remote.assert_not_called()
+        self.assertEqual(verified, self.locks)
+
+    @patch('cwldep.logging')
+    @patch('cwldep.git.ls_remote')
+    def test_check_git_not_installed(self, mock_ls_remote, mock_logging):
+        cwldep.check_git("file:///repos/tools", self.tgt, None, {}, {}, cwldep.DepContext())
+        mock_logging.error.assert_called_with("Need install %s", self.rel)
+        mock_ls_remote.assert_not_called()
 
 
 class ExpandNsTestCase(unittest.TestCase):
@@ -218,10 +1147,10 @@ class ExpandNsTestCase(unittest.TestCase):
 
 
 class AddDepTestCase(unittest.TestCase):
-    @patch('cwldep.cwltool')
+    @patch('cwltool.load_tool.fetch_document')
     @patch('cwldep.os')
-    @patch('cwldep.ruamel')
-    def test_add_dep(self, mock_ruamel, mock_os, mock_cwltool):
+    @patch('ruamel.yaml.round_trip_dump')
+    def test_add_dep(self, mock_round_trip_dump, mock_os, mock_fetch_document):
         """
         Tests that add_dep will add a dep namespace and dependency
         """
@@ -230,7 +1159,7 @@ class AddDepTestCase(unittest.TestCase):
             "id": "myid",
             'class': 'Workflow',
         }
-        mock_cwltool.load_tool.fetch_document.return_value = mock_loader, mock_workflowobj, "uri"
+        mock_fetch_document.return_value = mock_loader, mock_workflowobj, "uri"
         mocked_open = mock_open()
 
         with patch("cwldep.open", mocked_open):
@@ -239,8 +1168,8 @@ class AddDepTestCase(unittest.TestCase):
                            set_version=None,
                            install_to=None)
 
-        self.assertTrue(mock_ruamel.yaml.round_trip_dump.called)
-        args, kwargs = mock_ruamel.yaml.round_trip_dump.call_args
+        self.assertTrue(mock_round_trip_dump.called)
+        args, kwargs = mock_round_trip_dump.call_args
         workflow = args[0]
         dependencies = workflow['hints']['dep:Dependencies']['dependencies']
         self.assertEqual(dependencies[0]['upstream'], "some_remote_url.cwl")
@@ -248,3 +1177,61 @@ class AddDepTestCase(unittest.TestCase):
 
         mocked_open.assert_called_with('_myfile.cwl_', 'w')
         mock_os.rename.assert_called_with('_myfile.cwl_', 'myfile.cwl')
+
+
+class FetchPoolTestCase(unittest.TestCase):
+    def test_single_job_runs_inline(self):
+        pool = cwldep.FetchPool(1)
+        done = []
+        pool.submit(done.append, 1)
+        self.assertEqual(done, [1])
+
+    def test_wait_includes_nested_tasks(self):
+        pool = cwldep.FetchPool(4)
+        done = []
+
+        def task(n):
+            done.append(n)
+            if n < 3:
+                pool.submit(task, n + 1)
+                pool.submit(task, n + 1)
+
+        pool.submit(task, 0)
+        pool.wait()
+        pool.shutdown()
+        self.assertEqual(len(done), 15)
+
+    def test_finished_tasks_are_released(self):
+        pool = cwldep.FetchPool(2)
+        for n in range(20):
+            pool.submit(abs, n)
+        # Let every queued task finish, unlike shutdown().
+        pool._executor.shutdown(wait=True)
+        self.assertEqual(pool._pending, set())
+
+    def test_wait_raises_task_error(self):
+        pool = cwldep.FetchPool(2)
+
+        def fail():
+            raise ValueError("boom")
+
+        pool.submit(fail)
+        with self.assertRaises(ValueError):
+            pool.wait()
+        pool.shutdown()
+
+    def test_wait_does_not_wait_for_others_after_error(self):
+        import threading
+        pool = cwldep.FetchPool(2)
+        release = threading.Event()
+
+        def fail():
+            raise ValueError("boom")
+
+        pool.submit(release.wait)
+        pool.submit(fail)
+        with self.assertRaises(ValueError):
+            pool.wait()
+        self.assertFalse(release.is_set())
+        release.set()
+        pool.shutdown()
@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from mock import patch, MagicMock
+from cwldep import git
+
+
+class GitCheckoutTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp, "upstream")
+        git.run_git(["init", "--quiet", self.repo])
+        self.commits = []
+        for n in range(3):
+            with open(os.path.join(self.repo, "tool.cwl"), "w") as f:
+                f.write("# version %d\n" % n)
+            git.run_git(["add", "tool.cwl"], cwd=self.repo)
+            git.run_git(["-c", "user.name=cwldep", "-c", "user.email=cwldep@example.com",
+                         "commit", "--quiet", "-m", "version %d" % n], cwd=self.repo)
+            self.commits.append(git.run_git(["rev-parse", "HEAD"], cwd=self.repo))
+        git.run_git(["tag", "v1", self.commits[1]], cwd=self.repo)
+        self.upstream = "file://" + self.repo
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _read(self, tgt):
+        with open(os.path.join(tgt, "tool.cwl")) as f:
+            return f.read()
+
+    def test_ls_remote(self):
+        git.run_git(["-c", "user.name=cwldep", "-c", "user.email=cwldep@example.com",
+                     "tag", "-a", "-m", "v0", "v0", self.commits[0]], cwd=self.repo)
+        refs = git.ls_remote(self.upstream)
+        self.assertEqual(git.resolve_ref(refs, "HEAD"), self.commits[2])
+        self.assertEqual(git.resolve_ref(refs, "v1"), self.commits[1])
+        self.assertEqual(git.resolve_ref(refs, "v0"), self.commits[0])
+        self.assertEqual(git.resolve_ref(refs, self.commits[0]), self.commits[0])
+        self.assertIsNone(git.resolve_ref(refs, self.commits[0][:10]))
+
+    def test_is_repository(self):
+        self.assertTrue(git.is_repository(self.repo))
+        bare = os.path.join(self.tmp, "bare.git")
+        git.run_git(["init", "--quiet", "--bare", bare])
+        self.assertTrue(git.is_repository(bare))
+        self.assertFalse(git.is_repository(os.path.join(self.repo, "tool.cwl")))
+        self.assertFalse(git.is_repository(os.path.join(self.tmp, "missing")))
+
+    @patch('cwldep.git.subprocess.check_output')
+    def test_run_git_timeout(self, mock_check_output):
+        mock_check_output.return_value = b""
+        tracer = MagicMock()
+        git.run_git(["fetch", "origin"], tracer=tracer, timeout=30)
+        mock_check_output.assert_called_with(
+            ["git", "-c", "http.lowSpeedLimit=1", "-c", "http.lowSpeedTime=30", "fetch", "origin"],
+            cwd=None, stderr=None)
+        self.assertEqual(tracer.span.call_args[0][0], "git fetch")
+
+    def test_parse_advertisement(self):
+        def pkt(line):
+            return b"%04x" % (len(line) + 4) + line
+        data = (pkt(b"# service=git-upload-pack\n") + b"0000" +
+                pkt(b"a" * 40 + b" HEAD\0multi_ack symref=HEAD:refs/heads/main\n") +
+                pkt(b"a" * 40 + b" refs/heads/main\n") +
+                pkt(b"b" * 40 + b" refs/tags/v1\n") +
+                pkt(b"c" * 40 + b" refs/tags/v1^{}\n") + b"0000")
+        refs = git.parse_advertisement(data)
+        self.assertEqual(refs, {"HEAD": "a" * 40, "refs/heads/main": "a" * 40,
+                                "refs/tags/v1": "b" * 40, "refs/tags/v1^{}": "c" * 40})
+        self.assertEqual(git.resolve_ref(refs, "v1"), "c" * 40)
+        self.assertEqual(git.resolve_ref(refs, "main"), "a" * 40)
+
+    def test_checkout_tag(self):
+        tgt = os.path.join(self.tmp, "checkout")
+        self.assertEqual(git.checkout(self.upstream, tgt, "v1"), self.commits[1])
+        self.assertEqual(self._read(tgt), "# version 1\n")
+
+    def test_checkout_shallow_commit(self):
+        tgt = os.path.join(self.tmp, "checkout")
+        self.assertEqual(git.checkout(self.upstream, tgt, self.commits[0], depth=1), self.commits[0])
+        self.assertEqual(self._read(tgt), "# version 0\n")
+        self.assertEqual(git.run_git(["rev-parse", "--is-shallow-repository"], cwd=tgt), "true")
+        self.assertEqual(git.run_git(["rev-list", "--count", "HEAD"], cwd=tgt), "1")
+
+    def test_checkout_abbreviated_commit(self):
+        tgt = os.path.join(self.tmp, "checkout")
+        self.assertEqual(git.checkout(self.upstream, tgt, self.commits[0][:10], depth=1), self.commits[0])
+
+    def test_checkout_git_invocations(self):
+        tgt = os.path.join(self.tmp, "checkout")
+        with patch("cwldep.git.run_git", wraps=git.run_git) as mock_run_git:
+            self.assertEqual(git.checkout(self.upstream, tgt, "v1"), self.commits[1])
+            self.assertEqual([c[0][0][0] for c in mock_run_git.call_args_list],
+                             ["init", "remote", "fetch", "-c"])
+            mock_run_git.reset_mock()
+            self.assertEqual(git.checkout(self.upstream, tgt, self.commits[1]), self.commits[1])
+            mock_run_git.assert_not_called()
+
+    def test_checkout_existing(self):
+        tgt = os.path.join(self.tmp, "checkout")
+        git.checkout(self.upstream, tgt, self.commits[0])
+        self.assertEqual(git.checkout(self.upstream, tgt, "HEAD"), self.commits[2])
+        self.assertEqual(self._read(tgt), "# version 2\n")
+
+    def test_checkout_shared_objects(self):
+        cache = os.path.join(self.tmp, "cache")
+        first = os.path.join(self.tmp, "first")
+        second = os.path.join(self.tmp, "second")
+        self.assertEqual(git.checkout(self.upstream, first, "v1", cache_dir=cache), self.commits[1])
+        self.assertEqual(git.checkout(self.upstream, second, self.commits[1], cache_dir=cache),
+                         self.commits[1])
+        with open(os.path.join(second, ".git", "objects", "info", "alternates")) as f:
+            self.assertTrue(f.read().startswith(cache))
+        # The checkout borrows every object from the shared repository.
+        self.assertEqual(os.listdir(os.path.join(second, ".git", "objects", "pack")), [])
+        git.run_git(["fsck"], cwd=second, stderr=subprocess.DEVNULL)
+
+    def test_checkout_from_bundle(self):
+        path = os.path.join(self.tmp, "upstream.bundle")
+        git.bundle(self.repo, self.commits[1], path)
+        tgt = os.path.join(self.tmp, "checkout")
+        self.assertEqual(git.checkout(self.upstream, tgt, self.commits[1], source=path), self.commits[1])
+        self.assertEqual(self._read(tgt), "# version 1\n")
+        self.assertEqual(git.run_git(["remote", "get-url", "origin"], cwd=tgt), self.upstream)
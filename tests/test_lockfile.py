@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from cwldep.lockfile import JsonLock, ShardedLock, open_lock
+
+
+class LockFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.base = os.path.join(self.tmp, "main.cwl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_json(self):
+        lock = open_lock(self.base)
+        self.assertIsInstance(lock, JsonLock)
+        self.assertEqual(lock.load(), {})
+        lock.save({"a.cwl": {"checksum": "00myhash123"}})
+        with open(self.base + ".dep.lock") as f:
+            self.assertEqual(json.load(f), {"a.cwl": {"checksum": "00myhash123"}})
+
+    def test_sharded_records_incrementally(self):
+        lock = open_lock(self.base, "sharded")
+        self.assertIsInstance(lock, ShardedLock)
+        lock.load()
+        lock.record("a.cwl", {"checksum": "00myhash123"})
+        lock.record("b.cwl", {"checksum": "77otherhash890"})
+        lock.record("a.cwl", {"checksum": "00changed"})
+
+        # A run that was interrupted here keeps what it recorded.
+        lock = open_lock(self.base)
+        self.assertIsInstance(lock, ShardedLock)
+        self.assertEqual(lock.load(), {"a.cwl": {"checksum": "00changed"},
+                                       "b.cwl": {"checksum": "77otherhash890"}})
+        self.assertEqual(lock.get("b.cwl"), {"checksum": "77otherhash890"})
+
+        lock.save({"a.cwl": {"checksum": "00changed"}})
+        shards = os.listdir(self.base + ".dep.lock.d")
+        self.assertEqual(len(shards), 1)
+        with open(os.path.join(self.base + ".dep.lock.d", shards[0])) as f:
+            self.assertEqual(f.read().count("\n"), 1)
+
+    def test_sharded_save_keeps_concurrent_entries(self):
+        first = open_lock(self.base, "sharded")
+        second = open_lock(self.base, "sharded")
+        first.load()
+        second.load()
+        first.record("x.cwl", {"checksum": "00x"})
+        second.record("y.cwl", {"checksum": "00y"})
+        first.save({"x.cwl": {"checksum": "00x"}})
+        second.save({"y.cwl": {"checksum": "00y"}})
+        self.assertEqual(open_lock(self.base).load(), {"x.cwl": {"checksum": "00x"},
+                                                       "y.cwl": {"checksum": "00y"}})
+
+        # A path this run loaded and no longer lists is still removed.
+        first.load()
+        first.save({"x.cwl": {"checksum": "00x"}})
+        self.assertEqual(open_lock(self.base).load(), {"x.cwl": {"checksum": "00x"}})
+
+    def test_sharded_save_rewrites_changed_shards_only(self):
+        lock = open_lock(self.base, "sharded")
+        lock.save({"a.cwl": {"checksum": "00a"}, "b.cwl": {"checksum": "00b"}})
+        inodes = {rel: os.stat(lock.shard(rel)).st_ino for rel in ("a.cwl", "b.cwl")}
+        lock.load()
+        lock.record("a.cwl", {"checksum": "00a"})
+        lock.save({"a.cwl": {"checksum": "00a"}, "b.cwl": {"checksum": "00b"}})
+        self.assertEqual(os.stat(lock.shard("a.cwl")).st_ino, inodes["a.cwl"])
+        self.assertEqual(os.stat(lock.shard("b.cwl")).st_ino, inodes["b.cwl"])
+
+        lock.load()
+        lock.record("a.cwl", {"checksum": "00changed"})
+        lock.save({"a.cwl": {"checksum": "00changed"}, "b.cwl": {"checksum": "00b"}})
+        self.assertNotEqual(os.stat(lock.shard("a.cwl")).st_ino, inodes["a.cwl"])
+        self.assertEqual(os.stat(lock.shard("b.cwl")).st_ino, inodes["b.cwl"])
+        with open(lock.shard("a.cwl")) as f:
+            self.assertEqual(f.read().count("\n"), 1)
+
+    def test_sharded_ignores_incomplete_line(self):
+        lock = open_lock(self.base, "sharded")
+        lock.record("a.cwl", {"checksum": "00myhash123"})
+        with open(lock.shard("a.cwl"), "a") as f:
+            f.write('{"path": "a.cwl", "entr')
+        self.assertEqual(lock.load(), {"a.cwl": {"checksum": "00myhash123"}})
+
+    def test_unchanged_entries_not_appended(self):
+        lock = open_lock(self.base, "sharded")
+        lock.save({"a.cwl": {"checksum": "00myhash123"}})
+        lock.load()
+        lock.record("a.cwl", {"checksum": "00myhash123"})
+        with open(lock.shard("a.cwl")) as f:
+            self.assertEqual(f.read().count("\n"), 1)
+
+    def test_switch_format(self):
+        open_lock(self.base).save({"a.cwl": {"checksum": "00myhash123"}})
+        lock = open_lock(self.base, "sharded")
+        self.assertEqual(lock.load(), {"a.cwl": {"checksum": "00myhash123"}})
+        lock.save(lock.load())
+        self.assertFalse(os.path.exists(self.base + ".dep.lock"))
+
+        lock = open_lock(self.base, "json")
+        self.assertEqual(lock.load(), {"a.cwl": {"checksum": "00myhash123"}})
+        lock.save(lock.load())
+        self.assertFalse(os.path.exists(self.base + ".dep.lock.d"))
+        self.assertIsInstance(open_lock(self.base), JsonLock)
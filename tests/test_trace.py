@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cwldep.trace import Tracer, NULL
+
+
+class TracerTestCase(unittest.TestCase):
+    def test_span_records_arguments(self):
+        tracer = Tracer()
+        with tracer.span("download", url="http://x/a.cwl", bytes=0) as span:
+            span["bytes"] += 10
+        self.assertEqual(len(tracer.spans), 1)
+        name, start, duration, tid, args = tracer.spans[0]
+        self.assertEqual(name, "download")
+        self.assertEqual(args, {"url": "http://x/a.cwl", "bytes": 10})
+        self.assertGreaterEqual(duration, 0)
+
+    def test_span_records_errors(self):
+        tracer = Tracer()
+        with self.assertRaises(ValueError):
+            with tracer.span("load", url="main.cwl"):
+                raise ValueError()
+        self.assertEqual(tracer.spans[0][4]["error"], "ValueError")
+
+    def test_disabled(self):
+        with NULL.span("verify") as span:
+            span["cache"] = "hit"
+        self.assertEqual(NULL.spans, [])
+
+    def test_summary(self):
+        tracer = Tracer()
+        for cache in ("hit", "hit", "miss"):
+            with tracer.span("verify", url="http://x/a.cwl", cache=cache, bytes=5):
+                pass
+        with tracer.span("download", url="http://x/b.cwl", bytes=7):
+            pass
+        summary = tracer.summary()
+        self.assertEqual(summary["verify"]["count"], 3)
+        self.assertEqual(summary["verify"]["hits"], 2)
+        self.assertEqual(summary["verify"]["misses"], 1)
+        self.assertEqual(summary["verify"]["bytes"], 15)
+        self.assertEqual(summary["download"]["bytes"], 7)
+        self.assertEqual(sorted(url for url, _ in tracer.slowest()), ["http://x/a.cwl", "http://x/b.cwl"])
+        self.assertIn("verify", tracer.format_summary())
+
+    def test_chrome_trace(self):
+        tracer = Tracer()
+        with tracer.span("load", url="main.cwl"):
+            pass
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "trace.json")
+            tracer.save(path)
+            with open(path) as f:
+                events = json.load(f)["traceEvents"]
+        finally:
+            shutil.rmtree(tmp)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[0]["name"], "load")
+        self.assertEqual(events[0]["args"], {"url": "main.cwl"})